@@ -0,0 +1,183 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from utils import to_float_obs
+
+"""
+Batched data augmentations for image observations, as in Reinforcement Learning
+with Augmented Data (https://arxiv.org/abs/2004.14990). Every transform is a
+module that takes a whole minibatch of (stacked) RGB frames of shape
+(batch, 3 * frames, height, width), uint8 or float in [0, 1], and returns floats.
+Randomness is drawn per image, and the batch is processed by a handful of
+vectorized ops instead of a loop over images.
+
+Transforms are registered by name, so they can be chained from a string:
+	augment = make_augmentation('crop+color_jitter')
+	b_obs = augment(b_obs)
+"""
+
+AUGMENTATIONS = {}
+
+GRAY_WEIGHTS = (0.299, 0.587, 0.114)
+
+
+def register_augmentation(name):
+	"""Class decorator that makes a transform available to make_augmentation under name"""
+	def register(cls):
+		AUGMENTATIONS[name] = cls
+		return cls
+	return register
+
+
+def make_augmentation(names, **kwargs):
+	"""
+	Chains registered augmentations into one module. names is a '+'-separated
+	string or a list of names, and None or 'no aug' give the identity. Keyword
+	arguments for a transform are passed as a dict under its name, e.g.
+	make_augmentation('rand_conv', rand_conv=dict(num_trans=4)).
+	"""
+	if names is None or names == 'no aug':
+		names = []
+	elif isinstance(names, str):
+		names = names.split('+')
+	for name in names:
+		if name not in AUGMENTATIONS:
+			raise ValueError('unknown augmentation %r, expected one of %s' % (name, sorted(AUGMENTATIONS)))
+	return nn.Sequential(*[AUGMENTATIONS[name](**kwargs.get(name, {})) for name in names])
+
+
+def _frames(imgs):
+	# view a (batch, 3 * frames, h, w) batch as (batch, frames, 3, h, w)
+	return imgs.reshape(imgs.shape[0], -1, 3, *imgs.shape[2:])
+
+
+def _grayscale(frames):
+	weights = frames.new_tensor(GRAY_WEIGHTS).view(1, 1, 3, 1, 1)
+	return (frames * weights).sum(2, keepdim=True)
+
+
+def random_conv_kernels(num_kernels, channels=3, kernel_size=3, device=None):
+	"""Random conv kernels, scaled like nn.init.xavier_normal_ on a Conv2d(channels, channels, kernel_size)"""
+	fan = channels * kernel_size * kernel_size
+	std = (2. / (fan + fan)) ** 0.5
+	return torch.randn(num_kernels, channels, channels, kernel_size, kernel_size, device=device) * std
+
+
+def batched_random_conv(imgs, kernels):
+	"""
+	Convolves a batch of (stacked) RGB frames with random kernels in a single
+	grouped convolution. With k kernels, consecutive runs of len(imgs) / k
+	images share a kernel, and all frames of an image use the same one.
+	"""
+	num_batch, num_channels, img_h, img_w = imgs.shape
+	num_kernels, channels, _, kernel_size, _ = kernels.shape
+	num_frames = num_channels // channels
+	kernels = kernels.to(imgs.device, imgs.dtype)
+	padding = kernel_size // 2
+	if num_kernels == 1:
+		out = F.conv2d(imgs.reshape(-1, channels, img_h, img_w), kernels[0], padding=padding)
+	else:
+		index = torch.arange(num_batch, device=imgs.device) * num_kernels // num_batch
+		weight = kernels[index.repeat_interleave(num_frames)].reshape(-1, channels, kernel_size, kernel_size)
+		out = F.conv2d(imgs.reshape(1, -1, img_h, img_w), weight, padding=padding, groups=num_batch * num_frames)
+	return out.reshape(num_batch, num_channels, img_h, img_w)
+
+
+@register_augmentation('rand_conv')
+class RandConv(nn.Module):
+	"""
+	Random convolution from network randomization. The num_trans kernels are
+	drawn once per instance, make a new instance to draw new ones.
+	"""
+	def __init__(self, num_trans=1):
+		super().__init__()
+		self.register_buffer('kernels', random_conv_kernels(num_trans))
+
+	def RandomConvolution(self, imgs):
+		with torch.no_grad():
+			return batched_random_conv(to_float_obs(imgs), self.kernels)
+
+	def forward(self, imgs):
+		return self.RandomConvolution(imgs)
+
+
+@register_augmentation('crop')
+class RandomCrop(nn.Module):
+	"""Pads by replicating the border and crops back to the original size at a random offset per image"""
+	def __init__(self, pad=4):
+		super().__init__()
+		self.pad = pad
+
+	def forward(self, imgs):
+		imgs = to_float_obs(imgs)
+		n, c, h, w = imgs.shape
+		device = imgs.device
+		padded = F.pad(imgs, (self.pad,) * 4, mode='replicate')
+		shift = torch.randint(0, 2 * self.pad + 1, (2, n, 1), device=device)
+		rows = (shift[0] + torch.arange(h, device=device)).view(n, 1, h, 1)
+		cols = (shift[1] + torch.arange(w, device=device)).view(n, 1, 1, w)
+		batch = torch.arange(n, device=device).view(n, 1, 1, 1)
+		channels = torch.arange(c, device=device).view(1, c, 1, 1)
+		return padded[batch, channels, rows, cols]
+
+
+@register_augmentation('color_jitter')
+class ColorJitter(nn.Module):
+	"""Scales brightness, contrast and saturation by random factors in [1 - strength, 1 + strength] per image"""
+	def __init__(self, brightness=0.4, contrast=0.4, saturation=0.4):
+		super().__init__()
+		self.brightness = brightness
+		self.contrast = contrast
+		self.saturation = saturation
+
+	def forward(self, imgs):
+		imgs = to_float_obs(imgs)
+		frames = _frames(imgs)
+
+		def factor(strength):
+			return torch.empty(frames.shape[0], 1, 1, 1, 1, device=imgs.device).uniform_(1 - strength, 1 + strength)
+
+		frames = frames * factor(self.brightness)
+		mean = frames.mean(dim=(2, 3, 4), keepdim=True)
+		frames = (frames - mean) * factor(self.contrast) + mean
+		gray = _grayscale(frames)
+		frames = (frames - gray) * factor(self.saturation) + gray
+		return frames.clamp_(0, 1).reshape(imgs.shape)
+
+
+@register_augmentation('cutout')
+class Cutout(nn.Module):
+	"""Zeroes a random rectangle with sides between min_size and max_size pixels in every image"""
+	def __init__(self, min_size=8, max_size=24):
+		super().__init__()
+		self.min_size = min_size
+		self.max_size = max_size
+
+	def forward(self, imgs):
+		imgs = to_float_obs(imgs)
+		n, c, h, w = imgs.shape
+		device = imgs.device
+		size = torch.randint(self.min_size, self.max_size + 1, (2, n, 1), device=device)
+		top = (torch.rand(n, 1, device=device) * (h - size[0] + 1)).long()
+		left = (torch.rand(n, 1, device=device) * (w - size[1] + 1)).long()
+		rows = torch.arange(h, device=device)
+		cols = torch.arange(w, device=device)
+		inside_rows = (rows >= top) & (rows < top + size[0])
+		inside_cols = (cols >= left) & (cols < left + size[1])
+		mask = inside_rows[:, None, :, None] & inside_cols[:, None, None, :]
+		return imgs.masked_fill(mask, 0.)
+
+
+@register_augmentation('grayscale')
+class RandomGrayscale(nn.Module):
+	"""Converts each image to grayscale with probability p"""
+	def __init__(self, p=0.3):
+		super().__init__()
+		self.p = p
+
+	def forward(self, imgs):
+		imgs = to_float_obs(imgs)
+		frames = _frames(imgs)
+		gray = _grayscale(frames).expand_as(frames)
+		convert = torch.rand(frames.shape[0], 1, 1, 1, 1, device=imgs.device) < self.p
+		return torch.where(convert, gray, frames).reshape(imgs.shape)
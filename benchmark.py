@@ -0,0 +1,260 @@
+import sys
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+from utils import make_env, Storage, get_device, autocast
+from models import make_policy, make_encoder
+from ppo import PPOUpdate, make_optimizer
+from augmentations import AUGMENTATIONS, make_augmentation, random_conv_kernels, batched_random_conv
+
+"""
+Micro-benchmarks for the hot paths of the training loop. Run all of them with
+	python benchmark.py
+or a selection by name, e.g.
+	python benchmark.py storage
+"""
+
+
+def timeit(fn, repeat=5, warmup=1, device=None):
+	"""Best wall time in seconds of fn() over repeat runs"""
+	device = get_device(device)
+	for _ in range(warmup):
+		fn()
+	times = []
+	for _ in range(repeat):
+		if device.type == 'cuda':
+			torch.cuda.synchronize()
+		start = time.perf_counter()
+		fn()
+		if device.type == 'cuda':
+			torch.cuda.synchronize()
+		times.append(time.perf_counter() - start)
+	return min(times)
+
+
+def benchmark_storage(num_envs=64, num_steps=256, obs_shape=(3, 64, 64), device=None):
+	"""Steps/sec of filling a rollout with a fresh and a preallocated Storage"""
+	device = get_device(device)
+	obs = torch.rand(num_envs, *obs_shape)
+	if device.type == 'cuda':
+		obs = obs.pin_memory()
+	action = torch.randint(0, 15, (num_envs,))
+	log_prob = torch.randn(num_envs)
+	value = torch.randn(num_envs)
+	reward = np.random.randn(num_envs)
+	done = np.random.rand(num_envs) < 0.01
+	info = [{} for _ in range(num_envs)]
+
+	configs = [
+		('fresh', dict()),
+		('preallocated', dict(preallocate=True)),
+		('preallocated on device', dict(preallocate=True, on_device=True)),
+	]
+	print('Storage rollout, %d envs x %d steps' % (num_envs, num_steps))
+	for name, kwargs in configs:
+		storage = Storage(obs_shape, num_steps, num_envs, device=device, **kwargs)
+
+		def rollout():
+			storage.reset()
+			for _ in range(num_steps):
+				storage.store(obs, action, reward, done, info, log_prob, value, reward)
+			storage.store_last(obs, value)
+			storage.compute_return_advantage()
+
+		seconds = timeit(rollout, device=device)
+		print('  %-24s %10.0f steps/sec' % (name, num_envs * num_steps / seconds))
+
+
+def benchmark_gae(steps=(128, 256, 1024), envs=(64, 256, 1024), device=None):
+	"""Seconds per compute_return_advantage for the Python loop and the TorchScript scan"""
+	device = get_device(device)
+	print('GAE, loop vs scan')
+	for num_steps in steps:
+		for num_envs in envs:
+			results = []
+			for fast_gae in (False, True):
+				storage = Storage((1,), num_steps, num_envs, normalize_advantage=False, device=device, on_device=True, fast_gae=fast_gae)
+				torch.manual_seed(0)
+				storage.reward.copy_(torch.randn(num_steps, num_envs))
+				storage.value.copy_(torch.randn(num_steps+1, num_envs))
+				storage.done.copy_((torch.rand(num_steps, num_envs) < 0.01).float())
+				seconds = timeit(storage.compute_return_advantage, device=device)
+				results.append((seconds, storage.advantage.clone()))
+			(loop, loop_adv), (scan, scan_adv) = results
+			print('  steps %5d envs %5d   loop %8.2f ms   scan %8.2f ms   %5.1fx   max diff %.1e' % (
+				num_steps, num_envs, loop * 1e3, scan * 1e3, loop / scan, (loop_adv - scan_adv).abs().max().item()))
+
+
+def benchmark_env(num_envs=64, num_steps=256, device=None):
+	"""Env steps/sec of the wrapper chain against the fused observation wrapper"""
+	configs = [
+		('chain float32', dict()),
+		('fused float32', dict(fused_obs=True)),
+		('chain uint8', dict(uint8_obs=True)),
+		('fused uint8', dict(uint8_obs=True, fused_obs=True)),
+	]
+	print('Env stepping, %d envs x %d steps' % (num_envs, num_steps))
+	for name, kwargs in configs:
+		env = make_env(num_envs, env_name='coinrun', device=device, **kwargs)
+		env.reset()
+		actions = torch.randint(0, env.action_space.n, (num_steps, num_envs))
+
+		def rollout():
+			for action in actions:
+				env.step(action)
+
+		seconds = timeit(rollout, device=device)
+		print('  %-24s %10.0f steps/sec' % (name, num_envs * num_steps / seconds))
+		env.close()
+
+
+def _looped_random_conv(imgs, conv):
+	# the per-image loop RandConv used before, kept as the reference
+	total_out = None
+	for index in range(imgs.shape[0]):
+		rand_out = conv(imgs[index:index+1].reshape(-1, 3, imgs.shape[2], imgs.shape[3]))
+		total_out = rand_out if total_out is None else torch.cat((total_out, rand_out), 0)
+	return total_out.reshape(imgs.shape)
+
+
+def benchmark_rand_conv(batch_sizes=(64, 512), device='cpu'):
+	"""Images/sec of the per-image RandConv loop against one grouped convolution"""
+	device = get_device(device)
+	print('Random convolution on', device)
+	for batch_size in batch_sizes:
+		imgs = torch.rand(batch_size, 3, 64, 64, device=device)
+		conv = nn.Conv2d(3, 3, kernel_size=3, bias=False, padding=1).to(device)
+		kernels = conv.weight.detach()[None]
+		per_image_kernels = random_conv_kernels(batch_size, device=device)
+		with torch.no_grad():
+			diff = (_looped_random_conv(imgs, conv) - batched_random_conv(imgs, kernels)).abs().max().item()
+			configs = [
+				('loop, shared kernel', lambda: _looped_random_conv(imgs, conv)),
+				('grouped, shared kernel', lambda: batched_random_conv(imgs, kernels)),
+				('grouped, per-image kernels', lambda: batched_random_conv(imgs, per_image_kernels)),
+			]
+			for name, fn in configs:
+				seconds = timeit(fn, device=device)
+				print('  batch %4d  %-28s %10.0f images/sec' % (batch_size, name, batch_size / seconds))
+		print('  batch %4d  max diff loop vs grouped %.1e' % (batch_size, diff))
+
+
+def benchmark_augmentations(batch_size=512, device=None):
+	"""Images/sec of every registered augmentation and of all of them chained"""
+	device = get_device(device)
+	imgs = torch.randint(0, 256, (batch_size, 3, 64, 64), dtype=torch.uint8, device=device)
+	print('Augmentations, batch %d on %s' % (batch_size, device))
+	with torch.no_grad():
+		for name in list(AUGMENTATIONS) + ['+'.join(AUGMENTATIONS)]:
+			augment = make_augmentation(name).to(device)
+			seconds = timeit(lambda: augment(imgs), device=device)
+			print('  %-48s %10.0f images/sec' % (name, batch_size / seconds))
+
+
+def benchmark_act(num_envs=64, device=None):
+	"""Rollout inference calls/sec of Policy.act against Policy.act_fast"""
+	device = get_device(device)
+	obs = torch.randint(0, 256, (num_envs, 3, 64, 64), dtype=torch.uint8)
+	print('Policy inference, %d envs on %s' % (num_envs, device))
+	for name in ('nature', 'impala'):
+		policy = make_policy(name, num_actions=15, device=device).eval()
+		for method in ('act', 'act_fast'):
+			seconds = timeit(lambda: getattr(policy, method)(obs), device=device, repeat=20)
+			print('  %-8s %-10s %10.1f calls/sec' % (name, method, 1 / seconds))
+
+
+def benchmark_encoder(batch_sizes=(64, 512), device='cpu'):
+	"""Forward and forward+backward images/sec of the IMPALA encoders"""
+	device = get_device(device)
+	configs = [
+		('impala (flat)', dict(name='impala')),
+		('impala_resnet', dict(name='impala_resnet')),
+		('impala_resnet channels_last', dict(name='impala_resnet', channels_last=True)),
+		('impala_resnet jit', dict(name='impala_resnet', compile='jit')),
+		('impala_resnet compile', dict(name='impala_resnet', compile='compile')),
+	]
+	print('Encoders on', device)
+	for batch_size in batch_sizes:
+		imgs = torch.rand(batch_size, 3, 64, 64, device=device)
+		for label, kwargs in configs:
+			encoder = make_encoder(**kwargs).to(device)
+
+			def forward():
+				with torch.no_grad():
+					encoder(imgs)
+
+			def backward():
+				encoder(imgs).sum().backward()
+
+			print('  batch %4d  %-30s forward %8.0f   forward+backward %8.0f images/sec' % (
+				batch_size, label, batch_size / timeit(forward, device=device), batch_size / timeit(backward, device=device)))
+
+
+def benchmark_amp(batch_size=512, device='cpu'):
+	"""Forward+backward images/sec of the policies in float32 and under bfloat16 autocast"""
+	device = get_device(device)
+	obs = torch.randint(0, 256, (batch_size, 3, 64, 64), dtype=torch.uint8, device=device)
+	print('Mixed precision, batch %d on %s' % (batch_size, device))
+	for name in ('nature', 'impala', 'impala_resnet'):
+		policy = make_policy(name, num_actions=15, device=device)
+		for amp_dtype in (None, torch.bfloat16):
+
+			def update():
+				with autocast(device, amp_dtype):
+					dist, value = policy(obs)
+				(dist.entropy().mean() + value.mean()).backward()
+
+			seconds = timeit(update, device=device)
+			print('  %-14s %-10s %10.0f images/sec' % (name, amp_dtype or 'float32', batch_size / seconds))
+
+
+def benchmark_update(batch_size=512, num_updates=10, device='cpu'):
+	"""PPO updates/sec, eager against compiled and with the Adam implementations"""
+	device = get_device(device)
+	obs = torch.randint(0, 256, (batch_size, 3, 64, 64), dtype=torch.uint8, device=device)
+	batch = (
+		obs,
+		torch.randint(0, 15, (batch_size,), device=device),
+		-torch.rand(batch_size, device=device),
+		torch.randn(batch_size, device=device),
+		torch.randn(batch_size, device=device),
+		torch.randn(batch_size, device=device),
+	)
+	configs = [
+		('eager, default Adam', dict()),
+		('eager, foreach Adam', dict(implementation='foreach')),
+		('eager, fused Adam', dict(implementation='fused')),
+		('compiled, fused Adam', dict(implementation='fused', compile=True)),
+	]
+	print('PPO updates, batch %d on %s' % (batch_size, device))
+	for name in ('nature', 'impala'):
+		for label, kwargs in configs:
+			policy = make_policy(name, num_actions=15, device=device)
+			optimizer = make_optimizer(policy.parameters(), lr=5e-4, implementation=kwargs.get('implementation'))
+			update = PPOUpdate(policy, optimizer, compile=kwargs.get('compile', False))
+
+			def updates():
+				for _ in range(num_updates):
+					update(*batch)
+
+			seconds = timeit(updates, device=device)
+			print('  %-8s %-24s %8.1f updates/sec' % (name, label, num_updates / seconds))
+
+
+BENCHMARKS = {
+	'storage': benchmark_storage,
+	'gae': benchmark_gae,
+	'env': benchmark_env,
+	'rand_conv': benchmark_rand_conv,
+	'augmentations': benchmark_augmentations,
+	'act': benchmark_act,
+	'encoder': benchmark_encoder,
+	'amp': benchmark_amp,
+	'update': benchmark_update,
+}
+
+
+if __name__ == '__main__':
+	for name in sys.argv[1:] or BENCHMARKS:
+		BENCHMARKS[name]()
@@ -0,0 +1,174 @@
+import glob
+import os
+import random
+import tempfile
+import threading
+import time
+from queue import Queue
+import numpy as np
+import torch
+
+"""
+Resumable training checkpoints. A checkpoint is a dict holding everything the
+Trainer needs to continue a run (see Trainer.state_dict); it keeps the
+'architecture' and 'state_dict' entries of models.save_policy, so
+models.load_policy reads it as well. Files are written to a temporary file
+and renamed over the old checkpoint, so a job killed while saving leaves the
+previous checkpoint intact. CheckpointWriter does the writing, optionally on
+a background thread so the learner only pays for copying the tensors.
+"""
+
+CHECKPOINT_VERSION = 1
+
+
+def snapshot(obj):
+	"""Copies the tensors in (nested dicts, lists and tuples of) obj to the cpu, so obj can be saved while training goes on"""
+	if isinstance(obj, torch.Tensor):
+		return obj.detach().to('cpu', copy=True)
+	if isinstance(obj, dict):
+		return {key: snapshot(value) for key, value in obj.items()}
+	if isinstance(obj, (list, tuple)):
+		return type(obj)(snapshot(value) for value in obj)
+	return obj
+
+
+def rng_state():
+	return dict(
+		python=random.getstate(),
+		numpy=np.random.get_state(),
+		torch=torch.get_rng_state(),
+		cuda=torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None
+	)
+
+
+def set_rng_state(state):
+	random.setstate(state['python'])
+	np.random.set_state(state['numpy'])
+	torch.set_rng_state(state['torch'])
+	if state['cuda'] is not None and torch.cuda.is_available():
+		torch.cuda.set_rng_state_all(state['cuda'])
+
+
+def atomic_save(obj, path):
+	"""torch.save to a temporary file next to path that is then renamed to path"""
+	directory = os.path.dirname(path) or '.'
+	os.makedirs(directory, exist_ok=True)
+	fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+	try:
+		with os.fdopen(fd, 'wb') as f:
+			torch.save(obj, f)
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(tmp_path, path)
+	except BaseException:
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+		raise
+
+
+class CheckpointWriter():
+	"""
+	Writes objects atomically with torch.save. write first takes a cpu
+	snapshot of the tensors on the calling thread; with background=True the
+	serialization and fsync then happen on a worker thread, with at most
+	max_pending snapshots waiting, so write blocks rather than piling up copies
+	when the disk falls behind. Given a tag, a write is also kept as
+	<name>_<tag><ext> next to path (a hard link where possible), and only the
+	keep_last most recent of those are kept. metrics reports the time spent
+	snapshotting, waiting for the queue and writing.
+	"""
+	def __init__(self, background=True, max_pending=1, keep_last=0):
+		self.background = background
+		self.keep_last = keep_last
+		self.snapshot_seconds = []
+		self.wait_seconds = []
+		self.write_seconds = []
+		self.error = None
+		if background:
+			self.queue = Queue(maxsize=max_pending)
+			self.thread = threading.Thread(target=self._run, daemon=True)
+			self.thread.start()
+
+	def _run(self):
+		while True:
+			item = self.queue.get()
+			try:
+				if item is None:
+					return
+				self._write(*item)
+			except Exception as error:
+				self.error = error
+			finally:
+				self.queue.task_done()
+
+	def _write(self, obj, path, tag):
+		start = time.perf_counter()
+		atomic_save(obj, path)
+		if tag is not None:
+			self._keep(path, tag)
+		self.write_seconds.append(time.perf_counter() - start)
+
+	def _keep(self, path, tag):
+		stem, ext = os.path.splitext(path)
+		tagged_path = '%s_%s%s' % (stem, tag, ext)
+		if os.path.exists(tagged_path):
+			os.remove(tagged_path)
+		try:
+			os.link(path, tagged_path)
+		except OSError:
+			atomic_save(load_checkpoint(path), tagged_path)
+		if self.keep_last:
+			# copies with a tag of the same length, which sort in the order they were written (e.g. zero-padded steps)
+			pattern = glob.escape(stem) + '_' + '?' * len(tag) + glob.escape(ext)
+			for old_path in sorted(glob.glob(pattern))[:-self.keep_last]:
+				os.remove(old_path)
+
+	def _raise_error(self):
+		if self.error is not None:
+			error, self.error = self.error, None
+			raise RuntimeError('writing a checkpoint failed') from error
+
+	def write(self, obj, path, tag=None):
+		"""Saves obj to path, and to a tagged copy subject to keep_last when tag is given"""
+		self._raise_error()
+		start = time.perf_counter()
+		obj = snapshot(obj)
+		self.snapshot_seconds.append(time.perf_counter() - start)
+		if not self.background:
+			self._write(obj, path, tag)
+			return
+		start = time.perf_counter()
+		self.queue.put((obj, path, tag))
+		self.wait_seconds.append(time.perf_counter() - start)
+
+	def flush(self):
+		"""Waits until everything written so far is on disk"""
+		if self.background:
+			self.queue.join()
+		self._raise_error()
+
+	def close(self):
+		if self.background and self.thread.is_alive():
+			self.queue.put(None)
+			self.thread.join()
+		self._raise_error()
+
+	def metrics(self):
+		"""Mean milliseconds per write spent snapshotting and blocked on the queue (learner) and writing (writer)"""
+		def mean_ms(seconds):
+			return 1e3 * sum(seconds) / len(seconds) if seconds else 0.
+		return dict(
+			writes=len(self.write_seconds),
+			snapshot_ms=mean_ms(self.snapshot_seconds),
+			wait_ms=mean_ms(self.wait_seconds),
+			write_ms=mean_ms(self.write_seconds)
+		)
+
+
+def load_checkpoint(path, map_location='cpu'):
+	# checkpoints hold numpy and python RNG states next to the tensors
+	try:
+		return torch.load(path, map_location=map_location, weights_only=False)
+	except TypeError:
+		return torch.load(path, map_location=map_location)
+
@@ -0,0 +1,282 @@
+import argparse
+import glob
+import os
+from queue import Empty
+import numpy as np
+import torch
+import torch.multiprocessing
+from utils import make_env, EnvPool, get_device, set_global_seeds
+from models import make_policy, load_policy, CHECKPOINT_DIR
+
+"""
+Compares checkpoints on the same environment pass. With N policies and k envs
+each, a single batch of N*k envs is stepped and every policy acts on its own
+slice of it, so comparing all checkpoints costs one environment pass instead
+of N:
+	python evaluate.py baseline_v6 IMPALA_v6 IMPALA_rand_conv_v8
+	python evaluate.py  # every checkpoint in checkpoints/
+
+evaluate_episodes scores complete episodes instead of a fixed number of steps:
+	python evaluate.py IMPALA_v6 --episodes 5
+
+EvalWorker evaluates snapshots of a policy that is still training in a
+background process, so evaluation does not pause the learner.
+"""
+
+
+def evaluate_policies(policies, envs_per_policy=64, num_steps=512, transforms=None, env_name='coinrun', num_levels=0, use_backgrounds=True, seed=0, device=None):
+	"""
+	Average return over num_steps steps of every policy, each acting on
+	envs_per_policy envs of one shared batch. transforms optionally holds a
+	callable (e.g. an augmentation) per policy that is applied to its
+	observations. Rewards are not normalized, as the running statistics of
+	the shared batch would mix the returns of the different policies.
+	"""
+	num_policies = len(policies)
+	transforms = transforms or [None] * num_policies
+	env = make_env(
+		num_policies * envs_per_policy,
+		env_name=env_name,
+		num_levels=num_levels,
+		use_backgrounds=use_backgrounds,
+		normalize_reward=False,
+		seed=seed,
+		device=device,
+		uint8_obs=True,
+		fused_obs=True,
+		seed_globals=False
+	)
+	obs = env.reset()
+	for policy in policies:
+		policy.eval()
+
+	rewards = []
+	for _ in range(num_steps):
+		actions = []
+		for index, (policy, transform) in enumerate(zip(policies, transforms)):
+			policy_obs = obs[index*envs_per_policy:(index+1)*envs_per_policy]
+			if transform is not None:
+				policy_obs = transform(policy_obs)
+			action, _, _ = policy.act_fast(policy_obs)
+			actions.append(action)
+		obs, reward, done, info = env.step(torch.cat(actions))
+		rewards.append(torch.as_tensor(reward, dtype=torch.float32))
+	env.close()
+
+	# (num_steps, num_policies * envs_per_policy) -> average return per policy
+	returns = torch.stack(rewards).sum(0).view(num_policies, envs_per_policy)
+	return returns.mean(1).tolist()
+
+
+# the procgen action that does nothing, given to envs that have finished their episodes
+NOOP_ACTION = 4
+
+
+def evaluate_episodes(policy, num_envs=64, episodes_per_env=1, env_name='coinrun', start_level=0, num_levels=0, use_backgrounds=True, seed=0, max_steps=10000, device=None, env_pool=None):
+	"""
+	Runs every env until it has completed episodes_per_env episodes and
+	returns statistics of the (unnormalized) episode returns. The levels are
+	fixed by start_level, num_levels and seed, and with an env_pool every call
+	starts from the same env state. Envs that are done are masked out of the
+	policy batch and step with NOOP_ACTION, so inference shrinks as envs finish;
+	inference_fraction is the share of env steps that needed the policy.
+	"""
+	env_kwargs = dict(
+		n_envs=num_envs,
+		env_name=env_name,
+		start_level=start_level,
+		num_levels=num_levels,
+		use_backgrounds=use_backgrounds,
+		normalize_reward=False,
+		seed=seed,
+		device=device,
+		uint8_obs=True,
+		fused_obs=True
+	)
+	if env_pool is not None:
+		env, obs = env_pool.reset(**env_kwargs)
+	else:
+		env = make_env(seed_globals=False, **env_kwargs)
+		obs = env.reset()
+	policy.eval()
+
+	running_return = np.zeros(num_envs)
+	completed = np.zeros(num_envs, dtype=np.int64)
+	episode_returns = []
+	num_steps = policy_steps = 0
+	while num_steps < max_steps:
+		active = np.flatnonzero(completed < episodes_per_env)
+		if len(active) == 0:
+			break
+		actions = torch.full((num_envs,), NOOP_ACTION, dtype=torch.long)
+		index = torch.from_numpy(active)
+		action, _, _ = policy.act_fast(obs[index])
+		actions[index] = action.long()
+		obs, reward, done, info = env.step(actions)
+		num_steps += 1
+		policy_steps += len(active)
+
+		running_return += reward
+		finished = active[done[active]]
+		episode_returns.extend(running_return[finished].tolist())
+		completed[finished] += 1
+		running_return[done] = 0.
+	if env_pool is None:
+		env.close()
+
+	returns = np.array(episode_returns)
+	half_width = 1.96 * returns.std(ddof=1) / np.sqrt(len(returns)) if len(returns) > 1 else float('nan')
+	mean = returns.mean() if len(returns) else float('nan')
+	return dict(
+		mean=float(mean),
+		median=float(np.median(returns)) if len(returns) else float('nan'),
+		ci95=(float(mean - half_width), float(mean + half_width)),
+		num_episodes=len(returns),
+		returns=returns.tolist(),
+		steps=num_steps,
+		inference_fraction=policy_steps / max(1, num_steps * num_envs)
+	)
+
+
+def _eval_worker(architecture, weights, snapshot_step, lock, requests, results, num_envs, num_steps, eval_episodes, num_threads, device, env_kwargs):
+	torch.set_num_threads(num_threads)
+	# the worker process has its own generators, seeded once for the actions it samples
+	set_global_seeds(env_kwargs.get('seed', 0))
+	policy = make_policy(
+		architecture['encoder'],
+		architecture['num_actions'],
+		in_channels=architecture['in_channels'],
+		feature_dim=architecture['feature_dim'],
+		device=device
+	).eval()
+	env_pool = EnvPool(max_envs=1)
+	stop = False
+	while not stop:
+		request = requests.get()
+		if request is None:
+			break
+		# snapshots submitted while the last one was evaluated are superseded by the latest
+		consumed = 1
+		while True:
+			try:
+				request = requests.get_nowait()
+			except Empty:
+				break
+			if request is None:
+				stop = True
+				break
+			consumed += 1
+
+		with lock:
+			policy.load_state_dict(weights)
+			step = snapshot_step.value
+
+		if eval_episodes:
+			episode_kwargs = {name: env_kwargs[name] for name in ('env_name', 'start_level', 'num_levels', 'use_backgrounds', 'seed') if name in env_kwargs}
+			stats = evaluate_episodes(policy, num_envs=num_envs, episodes_per_env=eval_episodes, device=device, env_pool=env_pool, **episode_kwargs)
+			results.put((step, stats['mean'], consumed))
+			continue
+
+		# the env and its reward normalization are rewound for every snapshot, like Trainer.evaluate does
+		env, obs = env_pool.reset(n_envs=num_envs, device=device, fused_obs=True, **env_kwargs)
+		rewards = []
+		for _ in range(num_steps):
+			action, _, _ = policy.act_fast(obs)
+			obs, reward, done, info = env.step(action)
+			rewards.append(torch.as_tensor(reward, dtype=torch.float32))
+		results.put((step, torch.stack(rewards).sum(0).mean(0).item(), consumed))
+	env_pool.close()
+
+
+class EvalWorker():
+	"""
+	Evaluates snapshots of a training policy in a background process. submit
+	copies the weights into shared memory and returns immediately; the worker
+	steps its env for num_steps steps with the snapshot, or with eval_episodes
+	> 0 scores that many complete episodes per env with evaluate_episodes, and
+	reports the average return, which poll collects. The env is kept in an
+	EnvPool, so like the synchronous evaluation every snapshot starts from the
+	same levels and reward statistics. When the learner submits faster than
+	the worker evaluates, only the latest snapshot is evaluated.
+	"""
+	def __init__(self, policy, num_envs=64, num_steps=256, eval_episodes=0, num_threads=1, device='cpu', **env_kwargs):
+		context = torch.multiprocessing.get_context('spawn')
+		self.weights = {name: tensor.detach().to('cpu', copy=True).share_memory_() for name, tensor in policy.state_dict().items()}
+		self.step = context.Value('q', -1, lock=False)
+		self.lock = context.Lock()
+		self.requests = context.Queue()
+		self.results = context.Queue()
+		self.pending = 0
+		self.process = context.Process(
+			target=_eval_worker,
+			args=(policy.architecture, self.weights, self.step, self.lock, self.requests, self.results, num_envs, num_steps, eval_episodes, num_threads, device, env_kwargs),
+			daemon=True
+		)
+		self.process.start()
+
+	def submit(self, policy, step):
+		"""Queues an evaluation of the current weights of policy, labelled with step"""
+		with self.lock:
+			with torch.no_grad():
+				for name, tensor in policy.state_dict().items():
+					self.weights[name].copy_(tensor)
+			self.step.value = step
+		self.requests.put(True)
+		self.pending += 1
+
+	def poll(self, block=False):
+		"""The (step, average return) results that have arrived, with block=True waits for every submitted snapshot"""
+		results = []
+		while self.pending:
+			try:
+				step, average_return, consumed = self.results.get(timeout=1.) if block else self.results.get_nowait()
+			except Empty:
+				if block and self.process.is_alive():
+					continue
+				if block:
+					raise RuntimeError('the evaluation worker exited with code %s' % self.process.exitcode)
+				break
+			self.pending -= consumed
+			results.append((step, average_return))
+		return results
+
+	def close(self):
+		if self.process.is_alive():
+			self.requests.put(None)
+			self.process.join()
+
+
+def main(args=None):
+	parser = argparse.ArgumentParser(description='Evaluate checkpoints on one shared env batch')
+	parser.add_argument('names', nargs='*', help='checkpoint names or paths, defaults to every checkpoint in %s/' % CHECKPOINT_DIR)
+	parser.add_argument('--envs-per-policy', type=int, default=64)
+	parser.add_argument('--num-steps', type=int, default=512)
+	parser.add_argument('--episodes', type=int, default=0, help='> 0 scores this many complete episodes per env and checkpoint instead')
+	parser.add_argument('--no-backgrounds', dest='use_backgrounds', action='store_false')
+	parser.add_argument('--device', default=None)
+	args = parser.parse_args(args)
+	device = get_device(args.device)
+
+	names = args.names or sorted(glob.glob(os.path.join(CHECKPOINT_DIR, '*.pt')))
+	loaded, policies = [], []
+	for name in names:
+		try:
+			policies.append(load_policy(name, device=device))
+			loaded.append(name)
+		except (KeyError, RuntimeError) as error:
+			print('Skipping %s: %s' % (name, error))
+
+	if args.episodes:
+		for name, policy in zip(loaded, policies):
+			stats = evaluate_episodes(policy, num_envs=args.envs_per_policy, episodes_per_env=args.episodes, use_backgrounds=args.use_backgrounds, device=device)
+			print('%-48s mean %8.3f  median %8.3f  95%% CI [%.3f, %.3f]  %d episodes, %.0f%% of steps ran the policy' % (
+				os.path.basename(name), stats['mean'], stats['median'], stats['ci95'][0], stats['ci95'][1], stats['num_episodes'], 100 * stats['inference_fraction']))
+		return
+
+	returns = evaluate_policies(policies, envs_per_policy=args.envs_per_policy, num_steps=args.num_steps, use_backgrounds=args.use_backgrounds, device=device)
+	for name, average_return in zip(loaded, returns):
+		print('%-48s %8.3f' % (os.path.basename(name), average_return))
+
+
+if __name__ == '__main__':
+	main()
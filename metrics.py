@@ -0,0 +1,212 @@
+import argparse
+import glob
+import json
+import os
+import numpy as np
+
+"""
+Append-only metrics log, one file per run (trainingResults/<run>.metrics).
+The file starts with a fixed-size header that describes the record layout,
+followed by fixed-size binary records, one per training iteration or
+evaluation. Writing a record appends a few dozen bytes, and reading needs
+only numpy, which memory-maps the records as a structured array:
+	metrics = read_metrics('trainingResults/IMPALA_v6.metrics')
+	plt.plot(metrics['step'], metrics['train_return'])
+Columns that were not measured in a record are NaN. The torch.save'd reward
+lists written by older runs are converted with
+	python metrics.py convert
+and read_results falls back to them for runs that have no metrics file.
+"""
+
+MAGIC = b'PPOMETRICS\n'
+HEADER_SIZE = 512
+
+METRICS_FIELDS = [
+	('step', '<i8'),
+	('wall_time', '<f8'),
+	('train_return', '<f4'),
+	('val_return', '<f4'),
+	('loss', '<f4'),
+	('steps_per_sec', '<f4'),
+]
+
+
+def metrics_path(results_dir, savename):
+	"""The metrics file of a run, savename with or without .pt"""
+	name = savename[:-3] if savename.endswith('.pt') else savename
+	return os.path.join(results_dir, name + '.metrics')
+
+
+def _header(dtype):
+	description = json.dumps(dict(fields=[[name, dtype.fields[name][0].str] for name in dtype.names]))
+	header = MAGIC + description.encode() + b'\n'
+	if len(header) > HEADER_SIZE:
+		raise ValueError('too many metrics fields for the header')
+	return header.ljust(HEADER_SIZE, b' ')
+
+
+def _read_dtype(f):
+	header = f.read(HEADER_SIZE)
+	if not header.startswith(MAGIC):
+		raise ValueError('not a metrics file')
+	description = json.loads(header[len(MAGIC):].decode())
+	return np.dtype([tuple(field) for field in description['fields']])
+
+
+def read_metrics(path):
+	"""The records of a metrics file as a read-only memory-mapped structured array"""
+	with open(path, 'rb') as f:
+		dtype = _read_dtype(f)
+	# a record still being written at the end of the file is left out
+	num_records = (os.path.getsize(path) - HEADER_SIZE) // dtype.itemsize
+	if num_records == 0:
+		return np.zeros(0, dtype=dtype)
+	return np.memmap(path, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=(num_records,))
+
+
+class MetricsWriter():
+	"""
+	Appends records to the metrics file at path. A new run replaces an
+	existing file; with resume_step the records of an existing file from
+	before resume_step are kept and later ones, logged after the checkpoint
+	that is being resumed, are dropped.
+	"""
+	def __init__(self, path, fields=METRICS_FIELDS, resume_step=None):
+		self.path = path
+		self.dtype = np.dtype(fields)
+		os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+		if resume_step is not None and os.path.exists(path):
+			records = read_metrics(path)
+			if records.dtype != self.dtype:
+				raise ValueError('%s was written with different fields' % path)
+			later = np.flatnonzero(records['step'] >= resume_step)
+			num_records = later[0] if len(later) else len(records)
+			del records
+			os.truncate(path, HEADER_SIZE + num_records * self.dtype.itemsize)
+			self.file = open(path, 'ab')
+		else:
+			self.file = open(path, 'wb')
+			self.file.write(_header(self.dtype))
+			self.file.flush()
+
+	def append(self, **values):
+		"""Appends one record, columns not in values are NaN (or 0 for integers)"""
+		record = np.zeros(1, dtype=self.dtype)
+		for name in self.dtype.names:
+			if self.dtype.fields[name][0].kind == 'f':
+				record[name] = np.nan
+		for name, value in values.items():
+			record[name] = value
+		self.file.write(record.tobytes())
+		self.file.flush()
+
+	def extend(self, records):
+		"""Appends a structured array of records with the fields of the file"""
+		self.file.write(np.ascontiguousarray(records, dtype=self.dtype).tobytes())
+		self.file.flush()
+
+	def close(self):
+		self.file.close()
+
+
+LEGACY_PREFIXES = (('training_Reward', 'train_return'), ('validation_Reward', 'val_return'))
+
+
+def load_legacy_rewards(path):
+	"""The rewards of a torch.save'd reward list, a single 0-d tensor counts as a list of one"""
+	import torch
+	from checkpoint import load_checkpoint
+	values = load_checkpoint(path)
+	if torch.is_tensor(values) and values.dim() == 0:
+		values = [values]
+	return [float(value) for value in values]
+
+
+def legacy_records(columns, steps_per_iteration=16384, eval_interval=196608, fields=METRICS_FIELDS):
+	"""
+	Metrics records for legacy reward lists, columns maps train_return and
+	val_return to their values, placed every steps_per_iteration and every
+	eval_interval steps like the old plots did
+	"""
+	records = {}
+	for column, interval in (('train_return', steps_per_iteration), ('val_return', eval_interval)):
+		for index, value in enumerate(columns.get(column, [])):
+			records.setdefault(index * interval, {})[column] = value
+	array = np.zeros(len(records), dtype=np.dtype(fields))
+	for name in array.dtype.names:
+		if array.dtype.fields[name][0].kind == 'f':
+			array[name] = np.nan
+	for row, step in enumerate(sorted(records)):
+		array['step'][row] = step
+		for column, value in records[step].items():
+			array[column][row] = value
+	return array
+
+
+def read_results(results_dir, name, **kwargs):
+	"""
+	The metrics records of a run, read from its metrics file or, for runs that
+	only have the legacy training_Reward_<run>.pt / validation_Reward_<run>.pt
+	lists, built from those (kwargs go to legacy_records)
+	"""
+	path = metrics_path(results_dir, name)
+	if os.path.exists(path):
+		return read_metrics(path)
+	columns = {}
+	for prefix, column in LEGACY_PREFIXES:
+		legacy_path = os.path.join(results_dir, '%s_%s.pt' % (prefix, name))
+		if os.path.exists(legacy_path):
+			columns[column] = load_legacy_rewards(legacy_path)
+	if not columns:
+		raise FileNotFoundError('%s has neither a metrics file nor reward lists for %s' % (results_dir, name))
+	return legacy_records(columns, **kwargs)
+
+
+def convert_legacy_results(results_dir='trainingResults', steps_per_iteration=16384, eval_interval=196608):
+	"""
+	Writes a metrics file for every run in results_dir that only has the
+	torch.save'd training_Reward_<run>.pt / validation_Reward_<run>.pt lists,
+	see legacy_records. Files that cannot be read are reported and skipped.
+	"""
+	runs = {}
+	for prefix, column in LEGACY_PREFIXES:
+		for path in glob.glob(os.path.join(results_dir, prefix + '*.pt')):
+			name = os.path.basename(path)[len(prefix):-len('.pt')].lstrip('_') or 'unnamed'
+			try:
+				runs.setdefault(name, {})[column] = load_legacy_rewards(path)
+			except Exception as error:
+				print('Skipping %s: %s' % (path, error))
+	converted = []
+	for name, columns in sorted(runs.items()):
+		path = metrics_path(results_dir, name)
+		if not columns or os.path.exists(path):
+			continue
+		writer = MetricsWriter(path)
+		writer.extend(legacy_records(columns, steps_per_iteration, eval_interval, writer.dtype))
+		writer.close()
+		converted.append(path)
+	return converted
+
+
+def main(args=None):
+	parser = argparse.ArgumentParser(description='Metrics files of training runs')
+	commands = parser.add_subparsers(dest='command')
+	convert = commands.add_parser('convert', help='convert the legacy reward lists in a results directory')
+	convert.add_argument('results_dir', nargs='?', default='trainingResults')
+	show = commands.add_parser('show', help='print the records of a metrics file')
+	show.add_argument('path')
+	args = parser.parse_args(args)
+	if args.command == 'convert':
+		for path in convert_legacy_results(args.results_dir):
+			print('Wrote', path)
+	elif args.command == 'show':
+		metrics = read_metrics(args.path)
+		print(' '.join('%14s' % name for name in metrics.dtype.names))
+		for record in metrics:
+			print(' '.join('%14.6g' % value for value in record))
+	else:
+		parser.print_help()
+
+
+if __name__ == '__main__':
+	main()
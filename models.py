@@ -0,0 +1,272 @@
+import os
+from math import exp
+from random import random
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from utils import orthogonal_init, get_device, to_device, to_float_obs, sample_categorical, autocast
+from checkpoint import load_checkpoint
+
+"""
+Network definitions shared by the training scripts and the evaluation code.
+The policy and value functions are linear projections from the encodings of
+one of the encoders below, which are registered by name in ENCODERS.
+"""
+
+CHECKPOINT_DIR = 'checkpoints'
+
+
+class Flatten(nn.Module):
+	def forward(self, x):
+		return x.view(x.size(0), -1)
+
+
+class NatureEncoder(nn.Module):
+	"""The NatureDQN encoder, used by the baseline model"""
+	def __init__(self, in_channels, feature_dim):
+		super().__init__()
+		self.layers = nn.Sequential(
+			nn.Conv2d(in_channels=in_channels, out_channels=32, kernel_size=8, stride=4), nn.ReLU(),
+			nn.Conv2d(in_channels=32, out_channels=64, kernel_size=4, stride=2), nn.ReLU(),
+			nn.Conv2d(in_channels=64, out_channels=64, kernel_size=3, stride=1), nn.ReLU(),
+			Flatten(),
+			nn.Linear(in_features=1024, out_features=feature_dim), nn.ReLU()
+		)
+		self.apply(orthogonal_init)
+
+	def forward(self, x):
+		return self.layers(x)
+
+
+class ImpalaEncoder(nn.Module):
+	"""
+	The deeper encoder of the IMPALA models, three stages of five 3x3 convs with
+	max pooling (https://arxiv.org/pdf/1802.01561.pdf, without residual connections)
+	"""
+	def __init__(self, in_channels, feature_dim):
+		super().__init__()
+		self.layers = nn.Sequential(
+			# outchannels 16
+			nn.Conv2d(in_channels=in_channels, out_channels=16, kernel_size=3, stride=1, padding=1),
+			nn.MaxPool2d(kernel_size=3, stride=2, padding=1), nn.ReLU(),
+			nn.Conv2d(in_channels=16, out_channels=16, kernel_size=3, stride=1, padding=1), nn.ReLU(),
+			nn.Conv2d(in_channels=16, out_channels=16, kernel_size=3, stride=1, padding=1),
+			nn.ReLU(),
+			nn.Conv2d(in_channels=16, out_channels=16, kernel_size=3, stride=1, padding=1), nn.ReLU(),
+			nn.Conv2d(in_channels=16, out_channels=16, kernel_size=3, stride=1, padding=1),
+
+			# outchannels 32
+			nn.Conv2d(in_channels=16, out_channels=32, kernel_size=3, stride=1, padding=1),
+			nn.MaxPool2d(kernel_size=3, stride=2, padding=1), nn.ReLU(),
+			nn.Conv2d(in_channels=32, out_channels=32, kernel_size=3, stride=1, padding=1), nn.ReLU(),
+			nn.Conv2d(in_channels=32, out_channels=32, kernel_size=3, stride=1, padding=1),
+			nn.ReLU(),
+			nn.Conv2d(in_channels=32, out_channels=32, kernel_size=3, stride=1, padding=1), nn.ReLU(),
+			nn.Conv2d(in_channels=32, out_channels=32, kernel_size=3, stride=1, padding=1),
+
+			# outchannels 32
+			nn.Conv2d(in_channels=32, out_channels=32, kernel_size=3, stride=1, padding=1),
+			nn.MaxPool2d(kernel_size=3, stride=2, padding=1), nn.ReLU(),
+			nn.Conv2d(in_channels=32, out_channels=32, kernel_size=3, stride=1, padding=1), nn.ReLU(),
+			nn.Conv2d(in_channels=32, out_channels=32, kernel_size=3, stride=1, padding=1),
+			nn.ReLU(),
+			nn.Conv2d(in_channels=32, out_channels=32, kernel_size=3, stride=1, padding=1), nn.ReLU(),
+			nn.Conv2d(in_channels=32, out_channels=32, kernel_size=3, stride=1, padding=1),
+			nn.ReLU(),
+			Flatten(),
+			nn.Linear(in_features=2048, out_features=feature_dim), nn.ReLU()
+		)
+		self.apply(orthogonal_init)
+
+	def forward(self, x):
+		return self.layers(x)
+
+
+class ResidualBlock(nn.Module):
+	def __init__(self, channels):
+		super().__init__()
+		self.conv0 = nn.Conv2d(in_channels=channels, out_channels=channels, kernel_size=3, stride=1, padding=1)
+		self.conv1 = nn.Conv2d(in_channels=channels, out_channels=channels, kernel_size=3, stride=1, padding=1)
+
+	def forward(self, x):
+		out = self.conv0(F.relu(x))
+		out = self.conv1(F.relu(out))
+		return x + out
+
+
+class ImpalaStage(nn.Module):
+	"""A 3x3 conv and a strided max pool followed by two residual blocks"""
+	def __init__(self, in_channels, out_channels):
+		super().__init__()
+		self.conv = nn.Conv2d(in_channels=in_channels, out_channels=out_channels, kernel_size=3, stride=1, padding=1)
+		self.pool = nn.MaxPool2d(kernel_size=3, stride=2, padding=1)
+		self.res0 = ResidualBlock(out_channels)
+		self.res1 = ResidualBlock(out_channels)
+
+	def forward(self, x):
+		x = self.pool(self.conv(x))
+		return self.res1(self.res0(x))
+
+
+class ImpalaResNetEncoder(nn.Module):
+	"""
+	The IMPALA ResNet encoder (https://arxiv.org/pdf/1802.01561.pdf, without the
+	LSTM). With channels_last=True the weights and inputs use the channels-last
+	memory format, which the CPU and tensor-core convolution kernels prefer.
+	"""
+	def __init__(self, in_channels, feature_dim, channels=(16, 32, 32), channels_last=False):
+		super().__init__()
+		stages = []
+		for out_channels in channels:
+			stages.append(ImpalaStage(in_channels, out_channels))
+			in_channels = out_channels
+		self.stages = nn.Sequential(*stages)
+		self.fc = nn.Linear(in_features=channels[-1] * 8 * 8, out_features=feature_dim)
+		self.channels_last = channels_last
+		self.apply(orthogonal_init)
+		if channels_last:
+			self.to(memory_format=torch.channels_last)
+
+	def forward(self, x):
+		if self.channels_last:
+			x = x.contiguous(memory_format=torch.channels_last)
+		x = F.relu(self.stages(x))
+		return F.relu(self.fc(torch.flatten(x, 1)))
+
+
+# name: (encoder class, default feature_dim)
+ENCODERS = {
+	'nature': (NatureEncoder, 4096),
+	'impala': (ImpalaEncoder, 256),
+	'impala_resnet': (ImpalaResNetEncoder, 256),
+}
+
+
+class Policy(nn.Module):
+	"""
+	With amp_dtype set (e.g. torch.bfloat16) the act methods run the encoder
+	under autocast, and forward always returns float32 logits and values so the
+	losses are computed in full precision.
+	"""
+	def __init__(self, encoder, feature_dim, num_actions, device=None, amp_dtype=None):
+		super().__init__()
+		self.encoder = encoder
+		self.policy = orthogonal_init(nn.Linear(feature_dim, num_actions), gain=.01)
+		self.value = orthogonal_init(nn.Linear(feature_dim, 1), gain=1.)
+		self.device = get_device(device)
+		self.amp_dtype = amp_dtype
+		self.to(self.device)
+
+	def act(self, x):
+		with torch.no_grad(), autocast(self.device, self.amp_dtype):
+			x = to_device(x, self.device).contiguous()
+			dist, value = self.forward(x)
+			action = dist.sample()
+			log_prob = dist.log_prob(action)
+		return action.cpu(), log_prob.cpu(), value.cpu()
+
+	def act_fast(self, x):
+		# same as act, but with a single log-softmax and no Categorical distribution
+		with torch.no_grad(), autocast(self.device, self.amp_dtype):
+			x = to_device(x, self.device).contiguous()
+			features = self.encoder(to_float_obs(x))
+			action, log_prob = sample_categorical(self.policy(features).float())
+			value = self.value(features).squeeze(1).float()
+		return action.cpu(), log_prob.cpu(), value.cpu()
+
+	def act_greedy(self, x):
+		with torch.no_grad(), autocast(self.device, self.amp_dtype):
+			x = to_device(x, self.device).contiguous()
+			dist, value = self.forward(x)
+			action = torch.argmax(dist.probs,dim=1)
+			log_prob = dist.log_prob(action)
+		return action.cpu(), log_prob.cpu(), value.cpu()
+
+	def select_act(self, x, eps_end, eps_start, eps_decay, step):
+		sample = random()
+		eps_threshold = eps_end + (eps_start - eps_end) * exp(-1 * step / eps_decay)
+		if sample > eps_threshold:
+			return self.act_greedy(x)
+		else:
+			return self.act(x)
+
+	def forward(self, x):
+		x = self.encoder(to_float_obs(x))
+		logits = self.policy(x).float()
+		value = self.value(x).squeeze(1).float()
+		dist = torch.distributions.Categorical(logits=logits)
+
+		return dist, value
+
+
+def make_encoder(name, in_channels=3, feature_dim=None, compile=None, **kwargs):
+	"""
+	Builds the encoder registered under name, with its default feature_dim unless
+	one is given. Other keyword arguments go to the encoder class. compile='jit'
+	scripts the encoder with TorchScript, which fuses its elementwise ops, and
+	compile='compile' uses torch.compile, whose inductor backend also folds the
+	ReLUs and residual adds into the surrounding kernels. Both keep the
+	parameter names, so checkpoints are interchangeable.
+	"""
+	if name not in ENCODERS:
+		raise ValueError('unknown encoder %r, expected one of %s' % (name, sorted(ENCODERS)))
+	encoder_class, default_feature_dim = ENCODERS[name]
+	encoder = encoder_class(in_channels=in_channels, feature_dim=feature_dim or default_feature_dim, **kwargs)
+	if compile == 'jit':
+		encoder = torch.jit.script(encoder)
+	elif compile == 'compile':
+		encoder.compile()
+	elif compile is not None:
+		raise ValueError("compile must be None, 'jit' or 'compile'")
+	return encoder
+
+
+def make_policy(name, num_actions, in_channels=3, feature_dim=None, device=None, amp_dtype=None, **kwargs):
+	"""Builds a Policy on top of the encoder registered under name, keyword arguments go to make_encoder"""
+	feature_dim = feature_dim or ENCODERS[name][1]
+	encoder = make_encoder(name, in_channels=in_channels, feature_dim=feature_dim, **kwargs)
+	policy = Policy(encoder=encoder, feature_dim=feature_dim, num_actions=num_actions, device=device, amp_dtype=amp_dtype)
+	policy.architecture = dict(encoder=name, in_channels=in_channels, feature_dim=feature_dim, num_actions=num_actions)
+	return policy
+
+
+def checkpoint_path(name):
+	"""Resolves a checkpoint name such as 'IMPALA_v6' to a file in checkpoints/, paths are kept as they are"""
+	if os.path.exists(name):
+		return name
+	return os.path.join(CHECKPOINT_DIR, name if name.endswith('.pt') else name + '.pt')
+
+
+def save_policy(policy, path):
+	"""Saves the weights of a policy built by make_policy together with its architecture"""
+	torch.save(dict(architecture=policy.architecture, state_dict=policy.state_dict()), path)
+
+
+def _infer_architecture(state_dict):
+	# checkpoints saved before save_policy hold only the weights
+	first_conv = state_dict['encoder.layers.0.weight']
+	num_actions, feature_dim = state_dict['policy.weight'].shape
+	return dict(
+		encoder='nature' if first_conv.shape[-1] == 8 else 'impala',
+		in_channels=first_conv.shape[1],
+		feature_dim=feature_dim,
+		num_actions=num_actions
+	)
+
+
+def load_policy(name, device=None):
+	"""
+	Loads a policy from checkpoints/ by name (or from a path), rebuilding its
+	architecture from the metadata stored by save_policy or a training
+	checkpoint or, for older checkpoints that only hold weights, from the
+	shapes of the weights
+	"""
+	device = get_device(device)
+	checkpoint = load_checkpoint(checkpoint_path(name), map_location=device)
+	if 'state_dict' in checkpoint:
+		architecture, state_dict = checkpoint['architecture'], checkpoint['state_dict']
+	else:
+		architecture, state_dict = _infer_architecture(checkpoint), checkpoint
+	policy = make_policy(architecture['encoder'], architecture['num_actions'], in_channels=architecture['in_channels'], feature_dim=architecture['feature_dim'], device=device)
+	policy.load_state_dict(state_dict)
+	return policy
@@ -37,7 +37,7 @@ def show_stacked_imgs(x,max_display=16):
 show_imgs(x)
 show_stacked_imgs(stacked_x, max_display=9)
 
-import torch.nn as nn
+from augmentations import random_conv_kernels, batched_random_conv
 
 def random_convolution(imgs, num_trans=10):
     '''
@@ -45,27 +45,7 @@ def random_convolution(imgs, num_trans=10):
     
     (imbs): B x (C x stack) x H x W, note: imgs should be normalized and torch tensor
     '''
-    _device = imgs.device
-    
-    img_h, img_w = imgs.shape[2], imgs.shape[3]
-    num_stack_channel = imgs.shape[1]
-    num_batch = imgs.shape[0]
-    batch_size = int(num_batch / num_trans)
-    
-    # initialize random covolution
-    rand_conv = nn.Conv2d(3, 3, kernel_size=3, bias=False, padding=1).to(_device)
-    
-    for trans_index in range(num_trans):
-        torch.nn.init.xavier_normal_(rand_conv.weight.data)
-        temp_imgs = imgs[trans_index*batch_size:(trans_index+1)*batch_size]
-        temp_imgs = temp_imgs.reshape(-1, 3, img_h, img_w) # (batch x stack, channel, h, w)
-        rand_out = rand_conv(temp_imgs)
-        if trans_index == 0:
-            total_out = rand_out
-        else:
-            total_out = torch.cat((total_out, rand_out), 0)
-    total_out = total_out.reshape(-1, num_stack_channel, img_h, img_w)
-    return total_out
+    return batched_random_conv(imgs, random_conv_kernels(num_trans, device=imgs.device))
 
 
 device = torch.device('cpu')
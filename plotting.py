@@ -1,10 +1,6 @@
 import matplotlib.pyplot as plt
-import torch
 import numpy as np
-import imageio
-import torch.nn as nn
-import torch.nn.functional as F
-from utils import make_env, Storage, orthogonal_init
+from metrics import read_results
 
 
 # Models to make plots for
@@ -19,21 +15,20 @@ def moving_average(a, n=10) :
     ret[n:] = ret[n:] - ret[:-n]
     return ret / n
 
-total_training_reward_baseline = torch.load('trainingResults/training_Reward_' + savename_baseline + '.pt')
-total_training_reward_IMPALA = torch.load('trainingResults/training_Reward_' + savename_IMPALA + '.pt')
-total_training_reward_rand_conv = torch.load('trainingResults/training_Reward_' + savename_IMPALA_rand_conv + '.pt')
+# steps and values of the records of a run that have the column set
+# (runs without a metrics file are read from their old .pt reward lists)
+def load_column(savename, column):
+    metrics = read_results('trainingResults', savename)
+    measured = ~np.isnan(metrics[column])
+    return metrics['step'][measured], metrics[column][measured]
 
-x_train_baseline = range(0, (len(total_training_reward_baseline))*8192*2, 8192*2)
-x_train_IMPALA = range(0, (len(total_training_reward_IMPALA))*8192*2, 8192*2)
-x_train_rand_conv = range(0, (len(total_training_reward_rand_conv))*8192*2, 8192*2)
+x_train_baseline, total_training_reward_baseline = load_column(savename_baseline, 'train_return')
+x_train_IMPALA, total_training_reward_IMPALA = load_column(savename_IMPALA, 'train_return')
+x_train_rand_conv, total_training_reward_rand_conv = load_column(savename_IMPALA_rand_conv, 'train_return')
 
-total_validation_reward_baseline = torch.load('trainingResults/validation_Reward_' + savename_baseline + '.pt')
-total_validation_reward_IMPALA = torch.load('trainingResults/validation_Reward_' + savename_IMPALA + '.pt')
-total_validation_reward_rand_conv = torch.load('trainingResults/validation_Reward_' + savename_IMPALA_rand_conv + '.pt')
-
-x_val_baseline = range(0, (len(total_validation_reward_baseline))*196608, 196608)
-x_val_IMPALA = range(0, (len(total_validation_reward_IMPALA))*196608, 196608)
-x_val_rand_conv = range(0, (len(total_validation_reward_rand_conv))*196608, 196608)
+x_val_baseline, total_validation_reward_baseline = load_column(savename_baseline, 'val_return')
+x_val_IMPALA, total_validation_reward_IMPALA = load_column(savename_IMPALA, 'val_return')
+x_val_rand_conv, total_validation_reward_rand_conv = load_column(savename_IMPALA_rand_conv, 'val_return')
 
 plt.subplots(nrows=3,ncols=1,sharex='col', figsize=(12,6))
 # Baseline
@@ -83,14 +78,6 @@ plt.legend(loc=0); plt.grid()
 plt.tight_layout(); plt.show()
 
 
-total_validation_reward_baseline = torch.load('trainingResults/validation_Reward_' + savename_baseline + '.pt')
-total_validation_reward_IMPALA = torch.load('trainingResults/validation_Reward_' + savename_IMPALA + '.pt')
-total_validation_reward_rand_conv = torch.load('trainingResults/validation_Reward_' + savename_IMPALA_rand_conv + '.pt')
-
-x_val_baseline = range(8192*2, (len(total_validation_reward_baseline)+1)*8192*2, 8192*2)
-x_val_IMPALA = range(8192*2, (len(total_validation_reward_IMPALA)+1)*8192*2, 8192*2)
-x_val_rand_conv = range(8192*2, (len(total_validation_reward_rand_conv)+1)*8192*2, 8192*2)
-
 plt.figure(figsize=(16,6))
 plt.plot(x_val_baseline, total_validation_reward_baseline, label='total validation reward baseline')
 #plt.plot(x_val_baseline,moving_average(total_validation_reward_baseline), label = 'moving average baseline')
@@ -0,0 +1,83 @@
+import torch
+from labml_nn.rl.ppo import ClippedPPOLoss, ClippedValueFunctionLoss
+from utils import autocast, make_grad_scaler
+
+"""
+The PPO minibatch update shared by the training scripts:
+	optimizer = make_optimizer(policy.parameters(), lr=5e-4, implementation='fused')
+	update = PPOUpdate(policy, optimizer, compile=True)
+	for batch in storage.get_generator(batch_size):
+		update(*batch)
+"""
+
+OPTIMIZER_IMPLEMENTATIONS = (None, 'foreach', 'fused')
+
+
+def make_optimizer(parameters, lr, eps=1e-5, implementation=None):
+	"""
+	Adam with the given implementation: None lets PyTorch choose, 'foreach'
+	updates all parameters with a few multi-tensor ops and 'fused' in a single
+	kernel per step (CUDA, or CPU on recent PyTorch versions)
+	"""
+	if implementation not in OPTIMIZER_IMPLEMENTATIONS:
+		raise ValueError('implementation must be one of %s' % (OPTIMIZER_IMPLEMENTATIONS,))
+	kwargs = {implementation: True} if implementation else {}
+	return torch.optim.Adam(parameters, lr=lr, eps=eps, **kwargs)
+
+
+class PPOUpdate():
+	"""
+	One PPO step on a minibatch: the clipped policy and value losses with an
+	entropy bonus, backward, gradient clipping and the optimizer step.
+
+	With compile=True the forward pass and the losses go through torch.compile,
+	which also traces and compiles the matching backward graph, so the update
+	runs as a few fused kernels instead of many small eager ops. Gradient
+	clipping and the optimizer step stay outside the compiled region and use the
+	multi-tensor (foreach) code paths.
+	"""
+	def __init__(self, policy, optimizer, clip_value=.2, value_coef=.5, entropy_coef=.01, grad_eps=.5, amp_dtype=None, compile=False):
+		self.policy = policy
+		self.optimizer = optimizer
+		self.clip_value = clip_value
+		self.value_coef = value_coef
+		self.entropy_coef = entropy_coef
+		self.grad_eps = grad_eps
+		self.amp_dtype = amp_dtype
+		self.scaler = make_grad_scaler(policy.device, amp_dtype)
+		self.clipped_PPO_loss = ClippedPPOLoss()
+		self.clipped_value_loss = ClippedValueFunctionLoss()
+		self.loss = torch.compile(self._loss) if compile else self._loss
+
+	def _loss(self, obs, action, log_prob, value, returns, advantage):
+		# Get current policy outputs
+		with autocast(self.policy.device, self.amp_dtype):
+			new_dist, new_value = self.policy(obs)
+		new_log_prob = new_dist.log_prob(action)
+
+		# Clipped policy objective
+		pi_loss = self.clipped_PPO_loss(log_pi=new_log_prob, sampled_log_pi=log_prob, advantage=advantage, clip=self.clip_value)
+
+		# Clipped value function objective
+		value_loss = self.clipped_value_loss(value=new_value, sampled_value=value, sampled_return=returns, clip=self.clip_value)
+
+		# Entropy loss
+		entropy_loss = new_dist.entropy().mean()
+
+		return pi_loss + self.value_coef * value_loss - self.entropy_coef * entropy_loss
+
+	def __call__(self, obs, action, log_prob, value, returns, advantage):
+		loss = self.loss(obs, action, log_prob, value, returns, advantage)
+
+		# Backpropagate losses
+		self.scaler.scale(loss).backward()
+
+		# Clip gradients
+		self.scaler.unscale_(self.optimizer)
+		torch.nn.utils.clip_grad_norm_(self.policy.parameters(), self.grad_eps, foreach=True)
+
+		# Update policy
+		self.scaler.step(self.optimizer)
+		self.scaler.update()
+		self.optimizer.zero_grad(set_to_none=True)
+		return loss.detach()
@@ -0,0 +1,145 @@
+import argparse
+import dataclasses
+import json
+import multiprocessing as mp
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from train import Config, PRESETS, Trainer
+
+"""
+Runs many presets and seeds in parallel on one machine, without a scheduler:
+	python sweep.py compare --presets baseline impala impala_rand_conv --seeds 0 1 2 --threads 4 --set total_steps=2000000
+Every run trains in a worker process limited to --threads threads. Finished
+runs are appended to sweeps/<name>/results.jsonl, and running the same command
+again only starts the runs that have no result yet, continuing interrupted ones
+from their last training checkpoint.
+"""
+
+SWEEP_DIR = 'sweeps'
+
+
+def run_id(preset, seed):
+	return '%s_seed%d' % (preset, seed)
+
+
+def make_runs(name, presets, seeds, overrides=None, sweep_dir=SWEEP_DIR):
+	"""The (run_id, Config) pairs of a sweep, writing checkpoints and reward histories under sweep_dir/name"""
+	root = os.path.join(sweep_dir, name)
+	runs = []
+	for preset in presets:
+		for seed in seeds:
+			key = run_id(preset, seed)
+			fields = dict(
+				seed=seed,
+				savename=key + '.pt',
+				checkpoint_dir=os.path.join(root, 'checkpoints'),
+				results_dir=os.path.join(root, 'trainingResults'),
+				resume=True
+			)
+			fields.update(overrides or {})
+			config = dataclasses.replace(PRESETS[preset], **fields)
+			runs.append((key, config))
+	return runs
+
+
+def load_results(path):
+	"""The records of a results file by run id, later records replace earlier ones"""
+	results = {}
+	if os.path.exists(path):
+		with open(path) as f:
+			for line in f:
+				if line.strip():
+					record = json.loads(line)
+					results[record['run_id']] = record
+	return results
+
+
+def _init_worker(num_threads):
+	# each worker gets its share of the cores instead of one thread pool per core
+	import torch
+	os.environ['OMP_NUM_THREADS'] = str(num_threads)
+	os.environ['MKL_NUM_THREADS'] = str(num_threads)
+	torch.set_num_threads(num_threads)
+
+
+def _train(key, config):
+	start = time.time()
+	trainer = Trainer(config)
+	try:
+		trainer.train()
+	finally:
+		trainer.close()
+	return dict(
+		run_id=key,
+		status='done',
+		config=dataclasses.asdict(config),
+		seconds=time.time() - start,
+		steps=trainer.step,
+		training_reward=[float(reward) for reward in trainer.total_training_reward],
+		validation_reward=[float(reward) for reward in trainer.total_val_reward],
+	)
+
+
+def _run(key, config):
+	try:
+		return _train(key, config)
+	except Exception:
+		return dict(run_id=key, status='failed', config=dataclasses.asdict(config), error=traceback.format_exc())
+
+
+def run_sweep(runs, results_path, num_workers=None, num_threads=1):
+	"""
+	Trains the runs that have no finished record in results_path on a pool of
+	num_workers processes with num_threads threads each, appending a record
+	per run as it finishes. Failed runs are recorded and retried next time.
+	"""
+	done = {key for key, record in load_results(results_path).items() if record['status'] == 'done'}
+	pending = [(key, config) for key, config in runs if key not in done]
+	print('%d runs, %d done, %d to run' % (len(runs), len(runs) - len(pending), len(pending)))
+	if not pending:
+		return
+	num_workers = num_workers or max(1, (os.cpu_count() or 1) // num_threads)
+	os.makedirs(os.path.dirname(results_path) or '.', exist_ok=True)
+	# spawn gives every run a fresh interpreter, without the parent's threads and torch state
+	context = mp.get_context('spawn')
+	with ProcessPoolExecutor(min(num_workers, len(pending)), mp_context=context, initializer=_init_worker, initargs=(num_threads,)) as pool:
+		futures = [pool.submit(_run, key, config) for key, config in pending]
+		for future in as_completed(futures):
+			record = future.result()
+			with open(results_path, 'a') as f:
+				f.write(json.dumps(record) + '\n')
+			print('%s %s' % (record['run_id'], record['status']))
+			if record['status'] == 'failed':
+				print(record['error'])
+
+
+def _parse_override(item):
+	name, _, value = item.partition('=')
+	fields = {field.name: field for field in dataclasses.fields(Config)}
+	if name not in fields:
+		raise argparse.ArgumentTypeError('unknown config field %r' % name)
+	field_type = fields[name].type
+	if field_type is bool:
+		return name, value.lower() in ('1', 'true', 'yes')
+	return name, field_type(value)
+
+
+def main(args=None):
+	parser = argparse.ArgumentParser(description='Parallel sweep over presets and seeds')
+	parser.add_argument('name', help='results go to %s/<name>' % SWEEP_DIR)
+	parser.add_argument('--presets', nargs='+', default=sorted(PRESETS), choices=sorted(PRESETS))
+	parser.add_argument('--seeds', nargs='+', type=int, default=[0])
+	parser.add_argument('--workers', type=int, default=None, help='defaults to the number of cores divided by --threads')
+	parser.add_argument('--threads', type=int, default=1, help='torch threads per worker')
+	parser.add_argument('--set', nargs='*', type=_parse_override, default=[], metavar='FIELD=VALUE', help='overrides for every run')
+	args = parser.parse_args(args)
+	# the runs of a sweep use the cpu unless a device is set
+	overrides = dict(dict(device='cpu'), **dict(args.set))
+	runs = make_runs(args.name, args.presets, args.seeds, overrides)
+	run_sweep(runs, os.path.join(SWEEP_DIR, args.name, 'results.jsonl'), args.workers, args.threads)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,365 @@
+import argparse
+import copy
+import dataclasses
+import os
+import time
+from dataclasses import dataclass
+from math import sqrt
+import torch
+from utils import make_env, Storage, RolloutCollector, EnvPool, VecNormalize, find_wrappers, get_env_state, set_env_state, get_device, set_global_seeds
+from models import make_policy, CHECKPOINT_DIR
+from augmentations import make_augmentation
+from ppo import PPOUpdate, make_optimizer
+from evaluate import EvalWorker, evaluate_episodes
+from checkpoint import CHECKPOINT_VERSION, CheckpointWriter, rng_state, set_rng_state, load_checkpoint
+from metrics import MetricsWriter, metrics_path
+
+"""
+PPO training on procgen, configured by a Config. From the command line, start
+from one of the PRESETS and override any field:
+	python train.py impala --encoder impala_resnet --num-envs 32
+	python train.py impala --resume  # continue from checkpoints/IMPALA_v6.pt
+or from Python:
+	Trainer(dataclasses.replace(PRESETS['impala'], total_steps=1e6)).train()
+"""
+
+RESULTS_DIR = 'trainingResults'
+
+
+@dataclass
+class Config:
+	savename: str = 'IMPALA_v6.pt'
+	seed: int = 0 # seeds torch, numpy and random and offsets the env seeds, so runs with different seeds see different levels
+	env_name: str = 'coinrun'
+	encoder: str = 'impala' # see models.ENCODERS
+	feature_dim: int = None # None takes the default of the encoder
+	channels_last: bool = False # channels-last memory format, for the impala_resnet encoder
+	compile_encoder: str = None # 'jit' (TorchScript) or 'compile' (torch.compile) the encoder
+	augmentation: str = 'no aug' # e.g. "rand_conv" or "crop+color_jitter", see augmentations.py
+	augment_rollouts: bool = False # augment the frames stored by the rollout instead of every minibatch
+	num_rand_conv_kernels: int = 1 # > 1 gives each group of images in a batch its own random kernel
+	use_background: bool = True # backgrounds in the evaluation levels
+	total_steps: int = int(20e6)
+	num_envs: int = 64
+	num_levels: int = 200 # 0 = unlimited levels
+	num_steps: int = 256
+	num_epochs: int = 3
+	batch_size: int = 512
+	lr: float = 5e-4
+	grad_eps: float = .5
+	clip_value: float = .2
+	value_coef: float = .5
+	entropy_coef: float = .01
+	gamma: float = 0.99
+	uint8_obs: bool = True # keep raw frames, the policy scales them to [0, 1]
+	num_env_groups: int = 1 # 2 overlaps inference on one half of the envs with stepping the other
+	num_env_workers: int = 0 # > 0 steps each env group in that many worker processes
+	compile_update: bool = False # compile the forward pass and losses of each update with torch.compile
+	optimizer_impl: str = None # 'foreach' or 'fused' Adam
+	amp_dtype: str = None # 'bfloat16' runs rollouts and updates under autocast
+	device: str = None # cuda when available, otherwise cpu
+	eval_interval: int = 196608 # evaluate when the step count is a multiple of this
+	eval_episodes: int = 0 # > 0 scores this many complete episodes per eval env instead of num_steps steps
+	async_eval: bool = False # evaluate on the cpu in a background process instead of pausing training
+	eval_threads: int = 1 # torch threads of the background evaluation
+	save_interval: int = 999424 # save when the step count is a multiple of this
+	checkpoint_dir: str = CHECKPOINT_DIR
+	results_dir: str = RESULTS_DIR
+	resume: bool = False # continue from the training checkpoint at checkpoint_dir/savename if there is one
+	background_save: bool = False # write checkpoints on a thread instead of pausing training
+	keep_checkpoints: int = 0 # > 0 also keeps this many step-numbered checkpoints next to the latest one
+
+
+PRESETS = {
+	'baseline': Config(savename='baseline_v6.pt', encoder='nature'),
+	'impala': Config(savename='IMPALA_v6.pt', encoder='impala', lr=5e-4*1/sqrt(32/3), augment_rollouts=True),
+	'impala_rand_conv': Config(savename='IMPALA_rand_conv_v8.pt', encoder='impala', augmentation='rand_conv', lr=5e-4*1/sqrt(32/3), clip_value=.1),
+}
+
+
+class Trainer():
+	def __init__(self, config):
+		self.config = config
+		self.device = get_device(config.device)
+		self.amp_dtype = getattr(torch, config.amp_dtype) if config.amp_dtype else None
+		self.augment_rollouts = config.augment_rollouts and config.augmentation != 'no aug'
+		# rollout augmentation stores float frames
+		self.uint8_obs = config.uint8_obs and not self.augment_rollouts
+		seeds_per_group = max(1, config.num_env_workers)
+
+		# Define environment
+		# check the utils.py file for info on arguments
+		self.envs = [
+			make_env(
+				n_envs=config.num_envs // config.num_env_groups,
+				env_name=config.env_name,
+				num_levels=config.num_levels,
+				seed=(config.seed*config.num_env_groups + group)*seeds_per_group,
+				device=self.device,
+				uint8_obs=self.uint8_obs,
+				fused_obs=True,
+				num_workers=config.num_env_workers,
+				seed_globals=False
+			)
+			for group in range(config.num_env_groups)
+		]
+		# the random streams of a run (initialization, sampling, minibatches, augmentations) all follow from config.seed
+		set_global_seeds(config.seed)
+		env = self.envs[0]
+		print('Observation space:', env.observation_space)
+		print('Action space:', env.action_space.n)
+
+		# Define network
+		encoder_kwargs = dict(channels_last=True) if config.channels_last else {}
+		self.policy = make_policy(config.encoder, num_actions=env.action_space.n, feature_dim=config.feature_dim, device=self.device, amp_dtype=self.amp_dtype, compile=config.compile_encoder, **encoder_kwargs)
+
+		# Define optimizer
+		# these are reasonable values but probably not optimal
+		self.optimizer = make_optimizer(self.policy.parameters(), lr=config.lr, eps=1e-5, implementation=config.optimizer_impl)
+
+		# Define temporary storage
+		# we use this to collect transitions during each iteration
+		self.storage = Storage(
+			env.observation_space.shape,
+			config.num_steps,
+			config.num_envs,
+			gamma=config.gamma,
+			device=self.device,
+			preallocate=True,
+			obs_dtype=torch.uint8 if self.uint8_obs else torch.float32,
+			fast_gae=True
+		)
+
+		self.ppo_update = PPOUpdate(
+			self.policy,
+			self.optimizer,
+			clip_value=config.clip_value,
+			value_coef=config.value_coef,
+			entropy_coef=config.entropy_coef,
+			grad_eps=config.grad_eps,
+			amp_dtype=self.amp_dtype,
+			compile=config.compile_update
+		)
+		self.collector = RolloutCollector(self.envs, self.policy, self.storage)
+		self.eval_envs = EnvPool(max_envs=1)
+		self.eval_worker = None
+		if config.async_eval:
+			self.eval_worker = EvalWorker(
+				self.policy,
+				num_envs=config.num_envs,
+				num_steps=config.num_steps,
+				eval_episodes=config.eval_episodes,
+				num_threads=config.eval_threads,
+				num_levels=0,
+				env_name=config.env_name,
+				use_backgrounds=config.use_background,
+				uint8_obs=self.uint8_obs
+			)
+		self.step = 0
+		self.total_training_reward = []
+		self.total_val_reward = []
+		self.checkpoint_writer = CheckpointWriter(background=config.background_save, keep_last=config.keep_checkpoints)
+		resumed = config.resume and self.resume()
+		self.metrics = MetricsWriter(metrics_path(config.results_dir, config.savename), resume_step=self.step if resumed else None)
+
+	def make_augmentation(self):
+		# a new augmentation, e.g. new random kernels, every time
+		return make_augmentation(self.config.augmentation, rand_conv=dict(num_trans=self.config.num_rand_conv_kernels))
+
+	def collect(self):
+		"""Collects num_steps steps with the policy and computes returns and advantages"""
+		self.collector.transform = self.make_augmentation() if self.augment_rollouts else None
+		self.policy.eval()
+		self.collector.collect()
+		self.storage.compute_return_advantage()
+
+	def optimize(self):
+		"""num_epochs passes of PPO updates over the collected batch, returns the mean loss"""
+		self.policy.train()
+		total_loss, num_updates = 0., 0
+		augment_batches = self.config.augmentation != 'no aug' and not self.augment_rollouts
+		for epoch in range(self.config.num_epochs):
+			# Iterate over batches of transitions
+			generator = self.storage.get_generator(self.config.batch_size, prefetch=self.device.type == 'cuda')
+			for batch in generator:
+				b_obs, b_action, b_log_prob, b_value, b_returns, b_advantage = batch
+				if augment_batches:
+					b_obs = self.make_augmentation()(b_obs)
+
+				# Clipped PPO step on the batch
+				# the losses stay on the device until the end, one sync per iteration
+				total_loss = total_loss + self.ppo_update(b_obs, b_action, b_log_prob, b_value, b_returns, b_advantage)
+				num_updates += 1
+		return float(total_loss) / max(1, num_updates)
+
+	def evaluate(self):
+		"""Average return of num_steps steps, or of eval_episodes episodes per env, on unseen levels"""
+		config = self.config
+		if config.eval_episodes:
+			stats = evaluate_episodes(self.policy, num_envs=config.num_envs, episodes_per_env=config.eval_episodes, env_name=config.env_name, use_backgrounds=config.use_background, device=self.device, env_pool=self.eval_envs)
+			return torch.tensor(stats['mean'])
+
+		# the same env, rewound to the same levels, for every evaluation
+		eval_env, eval_obs = self.eval_envs.reset(n_envs=config.num_envs, num_levels=0, env_name=config.env_name, use_backgrounds=config.use_background, device=self.device, uint8_obs=self.uint8_obs, fused_obs=True)
+
+		val_reward = []
+		self.policy.eval()
+		for _ in range(config.num_steps):
+			# Use policy
+			eval_action, eval_log_prob, eval_value = self.policy.act_fast(eval_obs)
+
+			# Take step in environment
+			eval_obs, eval_reward, eval_done, eval_info = eval_env.step(eval_action)
+			val_reward.append(torch.Tensor(eval_reward))
+
+		# Calculate average return
+		return torch.stack(val_reward).sum(0).mean(0)
+
+	def record_eval_results(self, block=False):
+		"""Adds the returns reported by the background evaluation"""
+		for step, average_return in self.eval_worker.poll(block):
+			self.total_val_reward.append(torch.tensor(average_return))
+			self.metrics.append(step=step, wall_time=time.time(), val_return=average_return)
+			print('Step:', step, ' Average return:', self.total_val_reward)
+
+	@property
+	def checkpoint_path(self):
+		return os.path.join(self.config.checkpoint_dir, self.config.savename)
+
+	def normalizers(self):
+		return [wrapper for env in self.envs for wrapper in find_wrappers(env, VecNormalize)]
+
+	def state_dict(self):
+		"""Everything needed to resume training, the tensors are references like in nn.Module.state_dict"""
+		return dict(
+			version=CHECKPOINT_VERSION,
+			architecture=self.policy.architecture,
+			state_dict=self.policy.state_dict(),
+			config=dataclasses.asdict(self.config),
+			optimizer=self.optimizer.state_dict(),
+			scaler=self.ppo_update.scaler.state_dict(),
+			normalizers=[(copy.deepcopy(wrapper.ret_rms), wrapper.ret.copy()) for wrapper in self.normalizers()],
+			# the levels in progress and the observations the next rollout starts from
+			env_states=[get_env_state(env) for env in self.envs],
+			obs=list(self.collector.obs),
+			step=self.step,
+			total_training_reward=list(self.total_training_reward),
+			total_val_reward=list(self.total_val_reward),
+			rng=rng_state()
+		)
+
+	def load_state_dict(self, state):
+		self.policy.load_state_dict(state['state_dict'])
+		self.optimizer.load_state_dict(state['optimizer'])
+		self.ppo_update.scaler.load_state_dict(state['scaler'])
+		for wrapper, (ret_rms, ret) in zip(self.normalizers(), state['normalizers']):
+			wrapper.ret_rms = ret_rms
+			wrapper.ret = ret
+		env_states = state.get('env_states')
+		if env_states is not None and None not in env_states:
+			for env, env_state, obs, current_obs in zip(self.envs, env_states, state['obs'], self.collector.obs):
+				set_env_state(env, env_state)
+				current_obs.copy_(obs)
+		else:
+			print('The checkpoint has no env states, the envs start from new levels')
+		self.step = state['step']
+		self.total_training_reward = list(state['total_training_reward'])
+		self.total_val_reward = list(state['total_val_reward'])
+		set_rng_state(state['rng'])
+
+	def resume(self):
+		"""Loads the training checkpoint of this run, if one exists, and returns whether it did"""
+		if not os.path.exists(self.checkpoint_path):
+			return False
+		state = load_checkpoint(self.checkpoint_path)
+		if 'step' not in state:
+			# only policy weights, saved before training checkpoints existed
+			return False
+		self.load_state_dict(state)
+		print('Resuming from step', self.step)
+		return True
+
+	def save(self):
+		config = self.config
+		self.checkpoint_writer.write(self.state_dict(), self.checkpoint_path, tag='step%010d' % self.step if config.keep_checkpoints else None)
+
+	def train_iteration(self):
+		"""One rollout and the updates on it, evaluating and saving on schedule"""
+		config = self.config
+		start = time.perf_counter()
+		self.collect()
+		loss = self.optimize()
+		steps_per_sec = config.num_envs * config.num_steps / (time.perf_counter() - start)
+
+		# Update stats
+		train_return = self.storage.reward.sum(0).mean(0)
+		self.total_training_reward.append(train_return)
+		val_return = float('nan')
+
+		if self.step % config.eval_interval == 0:
+			if self.eval_worker is None:
+				self.total_val_reward.append(self.evaluate())
+				val_return = float(self.total_val_reward[-1])
+				print('Step:', self.step, ' Average return:', self.total_val_reward)
+			else:
+				self.eval_worker.submit(self.policy, self.step)
+		self.metrics.append(step=self.step, wall_time=time.time(), train_return=float(train_return), val_return=val_return, loss=loss, steps_per_sec=steps_per_sec)
+		if self.eval_worker is not None:
+			self.record_eval_results()
+		self.step += config.num_envs * config.num_steps
+		if self.step % config.save_interval == 0:
+			self.save()
+
+	def train(self):
+		while self.step < self.config.total_steps:
+			self.train_iteration()
+		if self.eval_worker is not None:
+			self.record_eval_results(block=True)
+		print('Completed training!')
+		self.save()
+		self.checkpoint_writer.flush()
+		print('Checkpoints:', self.checkpoint_writer.metrics())
+
+	def close(self):
+		self.checkpoint_writer.close()
+		for env in self.envs:
+			env.close()
+		self.eval_envs.close()
+		if self.eval_worker is not None:
+			self.eval_worker.close()
+		self.metrics.close()
+
+
+def _str2bool(value):
+	if value.lower() in ('1', 'true', 'yes'):
+		return True
+	if value.lower() in ('0', 'false', 'no'):
+		return False
+	raise argparse.ArgumentTypeError('expected a boolean, got %r' % value)
+
+
+def parse_config(args=None):
+	"""Builds a Config from a preset name followed by --field value overrides"""
+	parser = argparse.ArgumentParser(description='PPO training on procgen')
+	parser.add_argument('preset', nargs='?', default='impala', choices=sorted(PRESETS))
+	for field in dataclasses.fields(Config):
+		if field.type is bool:
+			# a bare --flag means true
+			parser.add_argument('--' + field.name.replace('_', '-'), dest=field.name, type=_str2bool, nargs='?', const=True, default=argparse.SUPPRESS)
+		else:
+			parser.add_argument('--' + field.name.replace('_', '-'), dest=field.name, type=field.type, default=argparse.SUPPRESS)
+	overrides = vars(parser.parse_args(args))
+	preset = overrides.pop('preset')
+	return dataclasses.replace(PRESETS[preset], **overrides)
+
+
+def main(args=None):
+	trainer = Trainer(parse_config(args))
+	try:
+		trainer.train()
+	finally:
+		trainer.close()
+
+
+if __name__ == '__main__':
+	main()
@@ -1,16 +1,21 @@
 import contextlib
+import copy
+import ctypes
+import functools
+import multiprocessing as mp
 import os
+import threading
+from queue import Queue, Full
 from abc import ABC, abstractmethod
 import numpy as np
 import gym
 import random
 from gym import spaces
 import time
-from collections import deque
+from collections import deque, OrderedDict
 import os
 import torch
 import torch.nn as nn
-from torch.utils.data.sampler import BatchSampler, SubsetRandomSampler
 from procgen import ProcgenEnv
 from collections import deque
 
@@ -27,102 +32,438 @@ def make_env(
 	use_backgrounds=False,
 	normalize_obs=False,
 	normalize_reward=True,
-	seed=0
+	seed=0,
+	device=None,
+	uint8_obs=False,
+	fused_obs=False,
+	num_workers=0,
+	seed_globals=True
 	):
-	"""Make environment for procgen experiments"""
-	set_global_seeds(seed)
+	"""
+	Make environment for procgen experiments. With uint8_obs=True the raw
+	frames are kept as uint8 and scaling to [0, 1] is left to the policy.
+	fused_obs=True replaces the observation wrappers with a single FusedObsFrame.
+	num_workers > 0 splits the envs evenly over that many worker processes.
+	seed_globals=False leaves the torch, numpy and python random generators
+	alone, for envs built while training is under way.
+	"""
+	if uint8_obs and normalize_obs:
+		raise ValueError('normalize_obs produces float observations and cannot be combined with uint8_obs')
+	if fused_obs and normalize_obs:
+		raise ValueError('normalize_obs is not supported with fused_obs')
+	if num_workers and n_envs % num_workers:
+		raise ValueError('n_envs must be divisible by num_workers')
+	if seed_globals:
+		set_global_seeds(seed)
 	set_global_log_levels(40)
-	env = ProcgenEnv(
-		num_envs=n_envs,
+	procgen_kwargs = dict(
 		env_name=env_name,
 		start_level=start_level,
 		num_levels=num_levels,
 		distribution_mode='easy',
 		use_backgrounds=use_backgrounds,
 		restrict_themes=not use_backgrounds,
-		render_mode='rgb_array',
-		rand_seed=seed
+		render_mode='rgb_array'
 	)
+	if num_workers:
+		env = SubprocVecEnv([
+			functools.partial(ProcgenEnv, num_envs=n_envs // num_workers, rand_seed=seed + i, **procgen_kwargs)
+			for i in range(num_workers)
+		])
+	else:
+		env = ProcgenEnv(num_envs=n_envs, rand_seed=seed, **procgen_kwargs)
+	if fused_obs:
+		env = VecNormalize(env, ob=False, ret=normalize_reward)
+		env = FusedObsFrame(env, "rgb", scale=not uint8_obs, device=device)
+		return env
+
 	env = VecExtractDictObs(env, "rgb")
 	env = VecNormalize(env, ob=normalize_obs, ret=normalize_reward)
 	env = TransposeFrame(env)
-	env = ScaledFloatFrame(env)
-	env = TensorEnv(env)
+	if not uint8_obs:
+		env = ScaledFloatFrame(env)
+	env = TensorEnv(env, device=device)
 	
 	return env
 
 
+def _wrappers(env):
+	# the wrappers of an env from the outermost in, followed by the innermost env
+	while isinstance(env, VecEnvWrapper):
+		yield env
+		env = env.venv
+	yield env
+
+
+def find_wrappers(env, wrapper_class):
+	"""The wrappers of type wrapper_class around env, from the outermost in"""
+	return [wrapper for wrapper in _wrappers(env) if isinstance(wrapper, wrapper_class)]
+
+
+def _gym3_env(env):
+	gym3_env = getattr(list(_wrappers(env))[-1], 'env', None)
+	return gym3_env if hasattr(gym3_env, 'callmethod') else None
+
+
+def get_env_state(env):
+	"""The procgen states of the envs in env, None when they cannot be saved (e.g. a SubprocVecEnv)"""
+	gym3_env = _gym3_env(env)
+	return gym3_env.callmethod('get_state') if gym3_env is not None else None
+
+
+def set_env_state(env, state):
+	"""Restores states returned by get_env_state, the wrappers around the procgen env are left alone"""
+	_gym3_env(env).callmethod('set_state', state)
+
+
+class EnvPool():
+	"""
+	Keeps up to max_envs environments built by make_env alive, keyed by their
+	make_env arguments, so that repeated evaluations reuse warm envs instead of
+	building new ones, and never reseeds the global random generators. reset
+	returns an env rewound to the state it was built in, with its first
+	observation, so every call starts from the same levels. Procgen envs are
+	rewound with get_state/set_state, anything else (e.g. a SubprocVecEnv) is
+	rebuilt. When the pool is full the least recently used env is closed.
+	"""
+	def __init__(self, max_envs=2):
+		if max_envs < 1:
+			raise ValueError('max_envs must be at least 1')
+		self.max_envs = max_envs
+		self.entries = OrderedDict()
+
+	@staticmethod
+	def _key(kwargs):
+		return tuple(sorted(kwargs.items()))
+
+	def _build(self, kwargs):
+		env = make_env(seed_globals=False, **kwargs)
+		obs = env.reset()
+		normalizers = [(wrapper, copy.deepcopy(wrapper.ret_rms)) for wrapper in find_wrappers(env, VecNormalize)]
+		return dict(env=env, obs=obs.clone(), state=get_env_state(env), normalizers=normalizers)
+
+	def _rewind(self, entry):
+		if entry['state'] is None:
+			return False
+		set_env_state(entry['env'], entry['state'])
+		for wrapper, ret_rms in entry['normalizers']:
+			wrapper.ret = np.zeros(wrapper.num_envs)
+			wrapper.ret_rms = copy.deepcopy(ret_rms)
+		return True
+
+	def reset(self, **kwargs):
+		"""The env make_env(**kwargs) builds, at its initial state, and its first observation"""
+		key = self._key(kwargs)
+		entry = self.entries.get(key)
+		if entry is not None and not self._rewind(entry):
+			self.evict(**kwargs)
+			entry = None
+		if entry is None:
+			entry = self.entries[key] = self._build(kwargs)
+			while len(self.entries) > self.max_envs:
+				_, oldest = self.entries.popitem(last=False)
+				oldest['env'].close()
+		self.entries.move_to_end(key)
+		return entry['env'], entry['obs'].clone()
+
+	def evict(self, **kwargs):
+		"""Closes the env built with kwargs, if the pool holds one"""
+		entry = self.entries.pop(self._key(kwargs), None)
+		if entry is not None:
+			entry['env'].close()
+
+	def close(self):
+		while self.entries:
+			_, entry = self.entries.popitem()
+			entry['env'].close()
+
+
+def get_device(device=None):
+	"""Resolve where to run, defaulting to the GPU when one is available"""
+	if device is None:
+		device = 'cuda' if torch.cuda.is_available() else 'cpu'
+	return torch.device(device)
+
+
+def to_device(x, device):
+	"""Move a tensor to device, without blocking the host when it sits in pinned memory"""
+	return x.to(device, non_blocking=x.is_pinned())
+
+
+def autocast(device, dtype=None):
+	"""Mixed precision context for device, a no-op when dtype is None"""
+	if dtype is None:
+		return contextlib.nullcontext()
+	return torch.autocast(get_device(device).type, dtype=dtype)
+
+
+def make_grad_scaler(device, dtype=None):
+	"""Loss scaling is only needed for float16, whose exponent range is too small for the gradients"""
+	return torch.amp.GradScaler(get_device(device).type, enabled=dtype == torch.float16)
+
+
+def prefetch_generator(generator, depth=1):
+	"""Runs generator on a background thread, keeping up to depth items ready"""
+	queue = Queue(maxsize=depth)
+	stop = threading.Event()
+
+	def put(message):
+		while not stop.is_set():
+			try:
+				queue.put(message, timeout=0.1)
+				return True
+			except Full:
+				pass
+		return False
+
+	def worker():
+		try:
+			for item in generator:
+				if not put((False, item)):
+					return
+		except Exception as error:
+			put((True, error))
+			return
+		put((True, None))
+
+	thread = threading.Thread(target=worker, daemon=True)
+	thread.start()
+	try:
+		while True:
+			done, item = queue.get()
+			if done:
+				if item is not None:
+					raise item
+				return
+			yield item
+	finally:
+		stop.set()
+
+
+def to_float_obs(x):
+	"""Scale uint8 frames to floats in [0, 1], float observations are returned as is"""
+	if x.dtype == torch.uint8:
+		return x.float().div_(255.)
+	return x
+
+
 class Storage():
-	def __init__(self, obs_shape, num_steps, num_envs, gamma=0.99, lmbda=0.95, normalize_advantage=True):
+	"""
+	Rollout buffer for PPO. Observations are kept as obs_dtype, so uint8 frames
+	take a quarter of the memory of float ones. fast_gae=True computes GAE with a
+	TorchScript reverse scan instead of the Python loop. With preallocate=True the tensors are allocated once
+	and every rollout is written into them in place, and with on_device=True they
+	live on the training device so minibatches need no host-to-device copy.
+	"""
+	def __init__(self, obs_shape, num_steps, num_envs, gamma=0.99, lmbda=0.95, normalize_advantage=True, device=None, preallocate=False, on_device=False, obs_dtype=torch.float32, fast_gae=False):
 		self.obs_shape = obs_shape
+		self.obs_dtype = obs_dtype
 		self.num_steps = num_steps
 		self.num_envs = num_envs
 		self.gamma = gamma
 		self.lmbda = lmbda
 		self.normalize_advantage = normalize_advantage
+		self.fast_gae = fast_gae
+		self.device = get_device(device)
+		self.preallocate = preallocate
+		self.buffer_device = self.device if on_device else torch.device('cpu')
+		self.obs = None
+		self._shuffled_obs = None
 		self.reset()
 
 	def reset(self):
-		self.obs = torch.zeros(self.num_steps+1, self.num_envs, *self.obs_shape)
-		self.action = torch.zeros(self.num_steps, self.num_envs)
-		self.reward = torch.zeros(self.num_steps, self.num_envs)
-		self.done = torch.zeros(self.num_steps, self.num_envs)
-		self.log_prob = torch.zeros(self.num_steps, self.num_envs)
-		self.value = torch.zeros(self.num_steps+1, self.num_envs)
-		self.returns = torch.zeros(self.num_steps, self.num_envs)
-		self.advantage = torch.zeros(self.num_steps, self.num_envs)
 		self.info = deque(maxlen=self.num_steps)
 		self.step = 0
+		if self.preallocate and self.obs is not None:
+			return
 
-	def store(self, obs, action, reward, done, info, log_prob, value):
-		self.obs[self.step] = obs.clone()
-		self.action[self.step] = action.clone()
-		self.reward[self.step] = torch.from_numpy(reward.copy())
-		self.done[self.step] = torch.from_numpy(done.copy())
+		kwargs = dict(device=self.buffer_device)
+		self.obs = torch.zeros(self.num_steps+1, self.num_envs, *self.obs_shape, dtype=self.obs_dtype, **kwargs)
+		self.action = torch.zeros(self.num_steps, self.num_envs, **kwargs)
+		self.reward = torch.zeros(self.num_steps, self.num_envs, **kwargs)
+		self.raw_reward = torch.zeros(self.num_steps, self.num_envs, **kwargs)
+		self.done = torch.zeros(self.num_steps, self.num_envs, **kwargs)
+		self.log_prob = torch.zeros(self.num_steps, self.num_envs, **kwargs)
+		self.value = torch.zeros(self.num_steps+1, self.num_envs, **kwargs)
+		self.returns = torch.zeros(self.num_steps, self.num_envs, **kwargs)
+		self.advantage = torch.zeros(self.num_steps, self.num_envs, **kwargs)
+
+	def store(self, obs, action, reward, done, info, log_prob, value, raw_reward=None):
+		if raw_reward is not None:
+			self.raw_reward[self.step].copy_(torch.from_numpy(raw_reward))
+		if self.preallocate:
+			self.obs[self.step].copy_(obs, non_blocking=obs.is_pinned())
+			self.action[self.step].copy_(action)
+			self.reward[self.step].copy_(torch.from_numpy(reward))
+			self.done[self.step].copy_(torch.from_numpy(done))
+			self.log_prob[self.step].copy_(log_prob)
+			self.value[self.step].copy_(value)
+		else:
+			self.obs[self.step] = obs.clone()
+			self.action[self.step] = action.clone()
+			self.reward[self.step] = torch.from_numpy(reward.copy())
+			self.done[self.step] = torch.from_numpy(done.copy())
+			self.log_prob[self.step] = log_prob.clone()
+			self.value[self.step] = value.clone()
 		self.info.append(info)
-		self.log_prob[self.step] = log_prob.clone()
-		self.value[self.step] = value.clone()
 		self.step = (self.step + 1) % self.num_steps
 
 	def store_last(self, obs, value):
-		self.obs[-1] = obs.clone()
-		self.value[-1] = value.clone()
+		if self.preallocate:
+			self.obs[-1].copy_(obs, non_blocking=obs.is_pinned())
+			self.value[-1].copy_(value)
+		else:
+			self.obs[-1] = obs.clone()
+			self.value[-1] = value.clone()
 
 	def compute_return_advantage(self):
-		advantage = 0
-		for i in reversed(range(self.num_steps)):
-			delta = (self.reward[i] + self.gamma * self.value[i+1] * (1 - self.done[i])) - self.value[i]
-			advantage = self.gamma * self.lmbda * advantage * (1 - self.done[i]) + delta
-			self.advantage[i] = advantage
+		if self.fast_gae:
+			not_done = 1 - self.done
+			delta = (self.reward + self.gamma * self.value[1:] * not_done) - self.value[:-1]
+			self.advantage.copy_(discounted_reverse_scan(delta, not_done, self.gamma * self.lmbda))
+		else:
+			advantage = 0
+			for i in reversed(range(self.num_steps)):
+				delta = (self.reward[i] + self.gamma * self.value[i+1] * (1 - self.done[i])) - self.value[i]
+				advantage = self.gamma * self.lmbda * advantage * (1 - self.done[i]) + delta
+				self.advantage[i] = advantage
 
-		self.returns = self.advantage + self.value[:-1]
+		torch.add(self.advantage, self.value[:-1], out=self.returns)
 		if self.normalize_advantage:
-			self.advantage = (self.advantage - self.advantage.mean()) / (self.advantage.std() + 1e-9)
-
-	def get_generator(self, batch_size=1024):
-		iterator = BatchSampler(SubsetRandomSampler(range(self.num_steps*self.num_envs)), batch_size, drop_last=True)
-		for indices in iterator:
-			obs = self.obs[:-1].reshape(-1, *self.obs_shape)[indices].cuda()
-			action = self.action.reshape(-1)[indices].cuda()
-			log_prob = self.log_prob.reshape(-1)[indices].cuda()
-			value = self.value[:-1].reshape(-1)[indices].cuda()
-			returns = self.returns.reshape(-1)[indices].cuda()
-			advantage = self.advantage.reshape(-1)[indices].cuda()
+			mean, std = self.advantage.mean(), self.advantage.std()
+			self.advantage.sub_(mean).div_(std + 1e-9)
+
+	def get_generator(self, batch_size=1024, prefetch=False):
+		"""
+		Yields shuffled minibatches. The rollout is permuted once per call with one
+		gather per buffer, and each batch is a contiguous slice of the result. With
+		prefetch=True the next batch is moved to the device on a background thread.
+		"""
+		batches = self._shuffled_batches(batch_size)
+		if prefetch:
+			batches = prefetch_generator(batches)
+		return batches
+
+	def _shuffled_batches(self, batch_size):
+		size = self.num_steps * self.num_envs
+		if self._shuffled_obs is None:
+			pin_memory = self.device.type == 'cuda' and self.buffer_device.type == 'cpu'
+			self._shuffled_obs = torch.empty(size, *self.obs_shape, dtype=self.obs_dtype, device=self.buffer_device, pin_memory=pin_memory)
+			self._shuffled_fields = torch.empty(5, size, device=self.buffer_device, pin_memory=pin_memory)
+		elif self._shuffled_obs.is_pinned():
+			# the previous epoch may still be copying out of the pinned buffers
+			torch.cuda.current_stream(self.device).synchronize()
+
+		indices = torch.randperm(size, device=self.buffer_device)
+		fields = torch.stack([self.action, self.log_prob, self.value[:-1], self.returns, self.advantage]).reshape(5, size)
+		torch.index_select(self.obs[:-1].reshape(size, *self.obs_shape), 0, indices, out=self._shuffled_obs)
+		torch.index_select(fields, 1, indices, out=self._shuffled_fields)
+
+		for start in range(0, size - batch_size + 1, batch_size):
+			obs = to_device(self._shuffled_obs[start:start+batch_size], self.device)
+			action, log_prob, value, returns, advantage = to_device(self._shuffled_fields[:, start:start+batch_size], self.device)
 			yield obs, action, log_prob, value, returns, advantage
 
 	def get_reward(self, normalized_reward=True):
+		# the unnormalized rewards from VecNormalize, as passed to store()
 		if normalized_reward:
-			reward = []
-			for step in range(self.num_steps):
-				info = self.info[step]
-				reward.append([d['reward'] for d in info])
-			reward = torch.Tensor(reward)
+			reward = self.raw_reward
 		else:
 			reward = self.reward
 		
 		return reward.mean(1).sum(0)
 
 
+@torch.jit.script
+def sample_categorical(logits):
+	"""
+	Samples from the categorical distribution given by logits with the
+	Gumbel-max trick, returning the actions and their log-probabilities.
+	"""
+	log_probs = torch.log_softmax(logits, dim=-1)
+	action = torch.argmax(log_probs - torch.log(torch.empty_like(log_probs).exponential_()), dim=-1)
+	log_prob = log_probs.gather(-1, action.unsqueeze(-1)).squeeze(-1)
+	return action, log_prob
+
+
+@torch.jit.script
+def discounted_reverse_scan(delta, not_done, discount: float):
+	"""
+	Scans out[i] = discount * out[i+1] * not_done[i] + delta[i] backwards over the
+	first dimension, with the same operation order as the loop in Storage.
+	"""
+	out = torch.empty_like(delta)
+	advantage = torch.zeros_like(delta[0])
+	for i in range(delta.size(0) - 1, -1, -1):
+		advantage = discount * advantage * not_done[i] + delta[i]
+		out[i] = advantage
+	return out
+
+
+class RolloutCollector():
+	"""
+	Fills a Storage with transitions from policy acting in envs, a list of
+	vectorized envs whose num_envs add up to the storage's. With more than one
+	group the next group's inference is launched before waiting on the current
+	group's step, so the two overlap whenever step_async does not block.
+	transform, if given, is applied to observations before acting and storing.
+	The policy's act_fast is used when it has one.
+	"""
+	def __init__(self, envs, policy, storage, transform=None):
+		self.envs = envs
+		self.policy = policy
+		self.storage = storage
+		self.transform = transform
+		self.act = getattr(policy, 'act_fast', policy.act)
+		self.obs = [env.reset() for env in envs]
+
+	def _act(self, group):
+		obs = self.obs[group]
+		if self.transform is not None:
+			obs = self.transform(obs)
+		action, log_prob, value = self.act(obs)
+		self.envs[group].step_async(action)
+		return obs, action, log_prob, value
+
+	def _wait(self, group, acted):
+		env = self.envs[group]
+		next_obs, reward, done, info = env.step_wait()
+		self.obs[group] = next_obs
+		return acted + (reward, done, info, getattr(env, 'raw_reward', None))
+
+	def _store(self, transitions):
+		if len(transitions) == 1:
+			obs, action, log_prob, value, reward, done, info, raw_reward = transitions[0]
+		else:
+			obs, action, log_prob, value, reward, done, info, raw_reward = zip(*transitions)
+			obs, action, log_prob, value = (torch.cat(x) for x in (obs, action, log_prob, value))
+			reward, done = np.concatenate(reward), np.concatenate(done)
+			info = [d for group_info in info for d in group_info]
+			raw_reward = None if raw_reward[0] is None else np.concatenate(raw_reward)
+		self.storage.store(obs, action, reward, done, info, log_prob, value, raw_reward)
+
+	def collect(self):
+		"""Steps every env storage.num_steps times and stores the rollout"""
+		num_steps, num_groups = self.storage.num_steps, len(self.envs)
+		pending = [None] * num_groups
+		pending[0] = self._act(0)
+		for step in range(num_steps):
+			transitions = []
+			for group in range(num_groups):
+				following = (group + 1) % num_groups
+				if following != group and (following > group or step + 1 < num_steps):
+					pending[following] = self._act(following)
+				transitions.append(self._wait(group, pending[group]))
+			self._store(transitions)
+			if num_groups == 1 and step + 1 < num_steps:
+				pending[0] = self._act(0)
+
+		# Add the last observation to collected data
+		obs = self.obs[0] if num_groups == 1 else torch.cat(self.obs)
+		_, _, value = self.act(obs)
+		self.storage.store_last(obs, value)
+
+
 def orthogonal_init(module, gain=nn.init.calculate_gain('relu')):
 	"""Orthogonal weight initialization: https://arxiv.org/abs/1312.6120"""
 	if isinstance(module, nn.Linear) or isinstance(module, nn.Conv2d):
@@ -375,6 +716,106 @@ def clear_mpi_env_vars():
 		os.environ.update(removed_environment)
 
 		
+def _subproc_worker(remote, parent_remote, env_fn_wrapper, obs_buffer, obs_shape, obs_dtype, obs_key, envs):
+	parent_remote.close()
+	env = env_fn_wrapper.x()
+	obs_view = np.frombuffer(obs_buffer, dtype=obs_dtype).reshape(obs_shape)[envs]
+
+	try:
+		while True:
+			cmd, data = remote.recv()
+			if cmd == 'step':
+				obs, rews, dones, infos = env.step(data)
+				obs_view[...] = obs[obs_key]
+				remote.send((rews, dones, infos))
+			elif cmd == 'reset':
+				obs_view[...] = env.reset()[obs_key]
+				remote.send(None)
+			elif cmd == 'close':
+				break
+			else:
+				raise NotImplementedError(cmd)
+	except KeyboardInterrupt:
+		print('SubprocVecEnv worker: got KeyboardInterrupt')
+	finally:
+		env.close()
+
+
+class SubprocVecEnv(VecEnv):
+	"""
+	Steps shards of a vectorized environment in worker processes. env_fns build
+	the shards, equally sized VecEnvs with dict observations. The workers write
+	the observation under obs_key straight into a shared-memory array, which is
+	returned without copying, so it is only valid until the next step or reset.
+	Other observation keys are dropped.
+
+	The default start method is forkserver where available, otherwise spawn.
+	Forking is avoided because the parent may already hold CUDA state (e.g.
+	the pinned buffers of another env group) and torch thread pools, which do
+	not survive a fork.
+	"""
+	def __init__(self, env_fns, obs_key='rgb', context=None):
+		dummy = env_fns[0]()
+		observation_space, action_space, self.shard_envs = dummy.observation_space, dummy.action_space, dummy.num_envs
+		dummy.close()
+		VecEnv.__init__(self, len(env_fns) * self.shard_envs, observation_space, action_space)
+
+		if context is None:
+			context = 'forkserver' if 'forkserver' in mp.get_all_start_methods() else 'spawn'
+		ctx = mp.get_context(context)
+		obs_space = observation_space.spaces[obs_key]
+		obs_shape = (self.num_envs,) + obs_space.shape
+		obs_dtype = np.dtype(obs_space.dtype)
+		self.obs_key = obs_key
+		self.obs_buffer = ctx.RawArray(ctypes.c_char, int(np.prod(obs_shape)) * obs_dtype.itemsize)
+		self.obs = np.frombuffer(self.obs_buffer, dtype=obs_dtype).reshape(obs_shape)
+
+		self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in env_fns])
+		self.processes = []
+		for i, (work_remote, remote, env_fn) in enumerate(zip(self.work_remotes, self.remotes, env_fns)):
+			envs = slice(i * self.shard_envs, (i + 1) * self.shard_envs)
+			args = (work_remote, remote, CloudpickleWrapper(env_fn), self.obs_buffer, obs_shape, obs_dtype, obs_key, envs)
+			process = ctx.Process(target=_subproc_worker, args=args, daemon=True)
+			with clear_mpi_env_vars():
+				process.start()
+			self.processes.append(process)
+			work_remote.close()
+		self.waiting = False
+
+	def reset(self):
+		if self.waiting:
+			self.step_wait()
+		for remote in self.remotes:
+			remote.send(('reset', None))
+		for remote in self.remotes:
+			remote.recv()
+		return {self.obs_key: self.obs}
+
+	def step_async(self, actions):
+		if self.waiting:
+			raise AlreadySteppingError()
+		for i, remote in enumerate(self.remotes):
+			remote.send(('step', actions[i * self.shard_envs:(i + 1) * self.shard_envs]))
+		self.waiting = True
+
+	def step_wait(self):
+		if not self.waiting:
+			raise NotSteppingError()
+		results = [remote.recv() for remote in self.remotes]
+		self.waiting = False
+		rews, dones, infos = zip(*results)
+		return {self.obs_key: self.obs}, np.concatenate(rews), np.concatenate(dones), [info for shard in infos for info in shard]
+
+	def close_extras(self):
+		if self.waiting:
+			for remote in self.remotes:
+				remote.recv()
+		for remote in self.remotes:
+			remote.send(('close', None))
+		for process in self.processes:
+			process.join()
+
+
 class VecFrameStack(VecEnvWrapper):
 	def __init__(self, venv, nstack):
 		self.venv = venv
@@ -446,7 +887,8 @@ def update_mean_var_count_from_moments(mean, var, count, batch_mean, batch_var,
 class VecNormalize(VecEnvWrapper):
 	"""
 	A vectorized wrapper that normalizes the observations
-	and returns from an environment.
+	and returns from an environment. The unnormalized rewards
+	of the last step are kept in raw_reward.
 	"""
 
 	def __init__(self, venv, ob=True, ret=True, clipob=10., cliprew=10., gamma=0.99, epsilon=1e-8):
@@ -458,13 +900,13 @@ class VecNormalize(VecEnvWrapper):
 		self.clipob = clipob
 		self.cliprew = cliprew
 		self.ret = np.zeros(self.num_envs)
+		self.raw_reward = np.zeros(self.num_envs)
 		self.gamma = gamma
 		self.epsilon = epsilon
 
 	def step_wait(self):
 		obs, rews, news, infos = self.venv.step_wait()
-		for i in range(len(infos)):
-			infos[i]['reward'] = rews[i]
+		self.raw_reward = rews
 		self.ret = self.ret * self.gamma + rews
 		obs = self._obfilt(obs)
 		if self.ret_rms:
@@ -491,7 +933,7 @@ class TransposeFrame(VecEnvWrapper):
 	def __init__(self, env):
 		super().__init__(venv=env)
 		obs_shape = self.observation_space.shape
-		self.observation_space = gym.spaces.Box(low=0, high=255, shape=(obs_shape[2], obs_shape[0], obs_shape[1]), dtype=np.float32)
+		self.observation_space = gym.spaces.Box(low=0, high=255, shape=(obs_shape[2], obs_shape[0], obs_shape[1]), dtype=self.observation_space.dtype)
 
 	def step_wait(self):
 		obs, reward, done, info = self.venv.step_wait()
@@ -518,8 +960,20 @@ class ScaledFloatFrame(VecEnvWrapper):
 
 
 class TensorEnv(VecEnvWrapper):
-	def __init__(self, env):
+	"""
+	Converts observations to torch tensors, uint8 frames stay uint8 and anything
+	else becomes float32. When the policy runs on a GPU the tensors are placed in
+	pinned memory, so the copy to the device is asynchronous.
+	"""
+	def __init__(self, env, device=None):
 		super().__init__(venv=env)
+		self.pin_memory = get_device(device).type == 'cuda'
+
+	def _to_tensor(self, obs):
+		dtype = torch.uint8 if obs.dtype == np.uint8 else torch.float32
+		tensor = torch.empty(obs.shape, dtype=dtype, pin_memory=self.pin_memory)
+		tensor.numpy()[...] = obs
+		return tensor
 
 	def step_async(self, actions):
 		if isinstance(actions, torch.Tensor):
@@ -528,8 +982,41 @@ class TensorEnv(VecEnvWrapper):
 
 	def step_wait(self):
 		obs, reward, done, info = self.venv.step_wait()
-		return torch.Tensor(obs), reward, done, info
+		return self._to_tensor(obs), reward, done, info
 
 	def reset(self):
 		obs = self.venv.reset()
-		return torch.Tensor(obs)
+		return self._to_tensor(obs)
+
+
+class FusedObsFrame(TensorEnv):
+	"""
+	Does the work of VecExtractDictObs, TransposeFrame, ScaledFloatFrame and
+	TensorEnv in one pass: the frame under key is transposed to CHW, divided by
+	255 if scale is set, and written straight into a (pinned) output tensor.
+	The output tensors are reused, so an observation is only valid until the
+	step after the one that follows it.
+	"""
+	def __init__(self, env, key, scale=True, device=None):
+		super().__init__(env, device=device)
+		self.key = key
+		self.scale = scale
+		obs_shape = env.observation_space.spaces[key].shape
+		obs_shape = (obs_shape[2], obs_shape[0], obs_shape[1])
+		if scale:
+			self.observation_space = gym.spaces.Box(low=0, high=1, shape=obs_shape, dtype=np.float32)
+		else:
+			self.observation_space = gym.spaces.Box(low=0, high=255, shape=obs_shape, dtype=np.uint8)
+		dtype = torch.float32 if scale else torch.uint8
+		self.buffers = [torch.empty(env.num_envs, *obs_shape, dtype=dtype, pin_memory=self.pin_memory) for _ in range(2)]
+		self.buffer_index = 0
+
+	def _to_tensor(self, obs):
+		frame = obs[self.key].transpose(0, 3, 1, 2)
+		tensor = self.buffers[self.buffer_index]
+		self.buffer_index = 1 - self.buffer_index
+		if self.scale:
+			np.divide(frame, np.float32(255.), out=tensor.numpy())
+		else:
+			tensor.numpy()[...] = frame
+		return tensor